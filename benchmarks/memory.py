@@ -0,0 +1,98 @@
+"""
+Measure the memory ELFFile needs for a kernel-sized symbol set, against the old list[Symbol].
+
+Both the memory held once all symbols are added and the peak while adding them and building
+the file are reported. Run with `python -m benchmarks.memory`.
+"""
+
+from __future__ import annotations
+
+import random
+import string
+import tracemalloc
+from dataclasses import dataclass
+
+from niche_elf import ELFFile
+from niche_elf.datatypes import Constants, ElfSym64
+
+from .strtab import KERNEL_SYMBOLS
+
+
+@dataclass
+class LegacySymbol:
+    """`Symbol` as ELFFile used to keep them, a plain dataclass with a `__dict__` each."""
+
+    name: str
+    bind: int
+    typ: int
+    value: int
+    size: int
+
+
+def legacy_build(symbols: list[LegacySymbol]) -> bytes:
+    """Build .symtab and .strtab the way `ELFBuilder.add_symbols` did for a list[Symbol]."""
+    # It appended to bytes, which only costs time.
+    strtab = bytearray(b"\x00")
+    name_offsets = {}
+    for s in symbols:
+        name_offsets[s.name] = len(strtab)
+        strtab += s.name.encode() + b"\x00"
+    null = ElfSym64(st_name=0, st_value=0, st_size=0, bind=0, typ=0, st_other=0, st_shndx=0)
+    symtab_entries = [null] + [
+        ElfSym64(
+            st_name=name_offsets[s.name],
+            st_value=s.value,
+            st_size=s.size,
+            bind=s.bind,
+            typ=s.typ,
+            st_other=0,
+            st_shndx=1,
+        )
+        for s in symbols
+    ]
+    return b"".join(bytes(e) for e in symtab_entries) + strtab
+
+
+def random_names(count: int) -> list[str]:
+    rng = random.Random(count)
+    alphabet = string.ascii_lowercase + "_"
+    return ["".join(rng.choices(alphabet, k=rng.randint(4, 40))) for _ in range(count)]
+
+
+def report(label: str, held: int, peak: int) -> None:
+    print(f"{label:<12} {held / 2**20:7.1f} MiB held, {peak / 2**20:7.1f} MiB peak")
+
+
+def main() -> None:
+    # Like a parsed kallsyms, every name is only materialized as a str right before it's added.
+    names = [name.encode() for name in random_names(KERNEL_SYMBOLS)]
+    base = 0xFFFFFFFF81000000
+
+    tracemalloc.start()
+    symbols = [
+        LegacySymbol(name.decode(), Constants.STB_GLOBAL, Constants.STT_FUNC, base + i * 0x10, 0)
+        for i, name in enumerate(names)
+    ]
+    old_held, _ = tracemalloc.get_traced_memory()
+    legacy_build(symbols)
+    _, old_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del symbols
+
+    tracemalloc.start()
+    elf = ELFFile(base)
+    for i, name in enumerate(names):
+        elf.add_function(name.decode(), base + i * 0x10)
+    new_held, _ = tracemalloc.get_traced_memory()
+    elf.build()
+    _, new_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{len(names)} symbols:")
+    report("list[Symbol]", old_held, old_peak)
+    report("SymbolStore", new_held, new_peak)
+    print(f"{old_held / new_held:.1f}x less held, {old_peak / new_peak:.1f}x lower peak")
+
+
+if __name__ == "__main__":
+    main()
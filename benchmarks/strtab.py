@@ -0,0 +1,70 @@
+"""
+Check that string table construction scales linearly with the number of symbols.
+
+Run with `python -m benchmarks.strtab`.
+"""
+
+import random
+import string
+import time
+
+from niche_elf import Symbol
+from niche_elf.builder import ELFBuilder
+from niche_elf.datatypes import Constants
+from niche_elf.structures import StrTab
+
+# Roughly the number of symbols in a /proc/kallsyms of a distro kernel.
+KERNEL_SYMBOLS = 200_000
+
+
+def random_symbols(count: int) -> list[Symbol]:
+    rng = random.Random(count)
+    alphabet = string.ascii_lowercase + "_"
+    return [
+        Symbol.function(
+            "".join(rng.choices(alphabet, k=rng.randint(4, 40))),
+            0xFFFFFFFF81000000 + i * 0x10,
+            0,
+            Constants.STB_GLOBAL,
+        )
+        for i in range(count)
+    ]
+
+
+def time_strtab(symbols: list[Symbol]) -> float:
+    start = time.perf_counter()
+    strtab = StrTab()
+    strtab.extend(s.name for s in symbols)
+    _ = strtab.data
+    return time.perf_counter() - start
+
+
+def time_add_symbols(symbols: list[Symbol]) -> float:
+    builder = ELFBuilder(Constants.EM_X86_64, 64)
+    builder.add_text_section(0xFFFFFFFF81000000)
+    start = time.perf_counter()
+    builder.add_symbols(symbols)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    # For a linear-time implementation doubling the input should roughly double the time.
+    previous: tuple[float, float] | None = None
+    for count in (KERNEL_SYMBOLS // 8, KERNEL_SYMBOLS // 4, KERNEL_SYMBOLS // 2, KERNEL_SYMBOLS):
+        symbols = random_symbols(count)
+        current = (time_strtab(symbols), time_add_symbols(symbols))
+        line = f"{count:>8} symbols:"
+        for label, elapsed, before in zip(
+            ("strtab", "add_symbols"),
+            current,
+            previous or current,
+            strict=True,
+        ):
+            ratio = f"{elapsed / before:.2f}x" if previous else "  -  "
+            line += f"  {label} {elapsed * 1000:8.1f} ms ({ratio})"
+        print(line)
+        previous = current
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Time the phases of building a symbol file and compare them against a stored baseline.
+
+Sizes go from a small binary up to a kernel with all its modules. Run with
+`python -m benchmarks.suite`, `--update` stores the results as the new baseline. The exit status
+is 1 if any phase got more than `--tolerance` slower (or bigger) than the baseline.
+
+The phases are:
+  ingest       kallsyms: `ELFFile.from_kallsyms`, decompiler: `ELFFile.add_symbols_bulk`
+  add_symbols  `ELFBuilder.add_symbols`
+  write        `ELFBuilder.write`
+and peak_mib is the peak traced memory over all three, measured in a separate run since
+tracemalloc slows everything down.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from niche_elf import ELFFile
+from niche_elf.builder import ELFBuilder
+from niche_elf.datatypes import Constants
+
+from . import workloads
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+BASELINE = Path(__file__).with_name("baseline.json")
+SIZES = (1_000, 10_000, 100_000, 1_000_000, 5_000_000)
+WORKLOADS = ("kallsyms", "decompiler")
+PHASES = ("ingest", "add_symbols", "write")
+
+# Phases faster than this are too noisy to compare.
+MIN_COMPARED_SECONDS = 0.005
+
+Results = dict[str, dict[str, float]]
+
+
+def make_ingest(workload: str, count: int) -> Callable[[], ELFFile]:
+    """Generate the input, and return a function that loads it into an `ELFFile`."""
+    if workload == "kallsyms":
+        listing = workloads.kallsyms(count)
+        return lambda: ELFFile.from_kallsyms(listing, workloads.KERNEL_TEXT)
+
+    symbols = workloads.decompiler(count)
+
+    def ingest() -> ELFFile:
+        elf = ELFFile(workloads.BINARY_TEXT)
+        elf.add_symbols_bulk(
+            symbols.names,
+            symbols.addrs,
+            symbols.sizes,
+            types=Constants.STT_FUNC,
+        )
+        return elf
+
+    return ingest
+
+
+def run_phases(ingest: Callable[[], ELFFile], path: str) -> dict[str, float]:
+    times = {}
+
+    start = time.perf_counter()
+    elf = ingest()
+    times["ingest"] = time.perf_counter() - start
+
+    builder = ELFBuilder(Constants.EM_X86_64, 64)
+    builder.add_text_section(elf.textbase)
+    start = time.perf_counter()
+    builder.add_symbols(elf.store)
+    times["add_symbols"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    builder.write(path)
+    times["write"] = time.perf_counter() - start
+
+    return times
+
+
+def measure(workload: str, count: int, path: str) -> dict[str, float]:
+    ingest = make_ingest(workload, count)
+
+    # Best of a few runs for the small sizes, where a single run is mostly noise.
+    runs = [run_phases(ingest, path) for _ in range(max(1, min(5, 100_000 // count)))]
+    result = {phase: min(run[phase] for run in runs) for phase in PHASES}
+
+    tracemalloc.start()
+    run_phases(ingest, path)
+    result["peak_mib"] = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result
+
+
+def compare(key: str, result: dict[str, float], baseline: Results, tolerance: float) -> bool:
+    """Print the result next to the baseline, and return whether anything regressed."""
+    before = baseline.get(key, {})
+    regressed = False
+    line = f"{key:>20}"
+    for metric, value in result.items():
+        unit = "MiB" if metric == "peak_mib" else "ms"
+        shown = value if metric == "peak_mib" else value * 1000
+        line += f"  {metric} {shown:9.1f} {unit}"
+        if metric in before:
+            ratio = value / before[metric] if before[metric] else 1.0
+            noisy = metric != "peak_mib" and value < MIN_COMPARED_SECONDS
+            flag = "!" if ratio > 1 + tolerance and not noisy else " "
+            regressed |= flag == "!"
+            line += f" ({ratio:4.2f}x{flag})"
+    print(line)
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the niche-elf benchmarks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--workloads", choices=WORKLOADS, nargs="+", default=WORKLOADS)
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update", action="store_true", help="store results as the baseline")
+    args = parser.parse_args()
+
+    baseline: Results = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    results: Results = {}
+    regressed = False
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "symbols.elf")
+        for workload in args.workloads:
+            for count in args.sizes:
+                key = f"{workload}/{count}"
+                results[key] = measure(workload, count, path)
+                regressed |= compare(key, results[key], baseline, args.tolerance)
+
+    if args.update:
+        for key, result in results.items():
+            baseline[key] = {metric: round(value, 5) for metric, value in result.items()}
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}")
+    elif regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
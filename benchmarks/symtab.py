@@ -0,0 +1,32 @@
+"""
+Compare the "ctypes" and "array" .symtab serialization backends.
+
+Run with `python -m benchmarks.symtab`.
+"""
+
+import time
+
+from niche_elf.builder import ELFBuilder
+from niche_elf.datatypes import Constants
+
+from .strtab import KERNEL_SYMBOLS, random_symbols
+
+
+def main() -> None:
+    symbols = random_symbols(KERNEL_SYMBOLS)
+    outputs = {}
+    for backend in ("ctypes", "array"):
+        builder = ELFBuilder(Constants.EM_X86_64, 64, backend)
+        builder.add_text_section(0xFFFFFFFF81000000)
+        start = time.perf_counter()
+        builder.add_symbols(symbols)
+        elapsed = time.perf_counter() - start
+        outputs[backend] = builder.sections[-1].data, builder.sections[-2].data
+        print(f"{backend:>6}: {elapsed * 1000:8.1f} ms for {len(symbols)} symbols")
+
+    if outputs["ctypes"] != outputs["array"]:
+        raise AssertionError("Backends produced different output.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Check `ELFFile.update_from` against a plain model of the changes, and time it.
+
+Random small files get random changes. The symbols of the updated file must match the model,
+and its entries (st_shndx included) and sections must match a fresh build of the same symbols.
+This covers the fast path, which patches the old .symtab, as well as the full rebuild when new
+locals would come after the other symbols. Then a decompiler-sized update is timed against a
+full write. Run with `python -m benchmarks.update`.
+"""
+
+from __future__ import annotations
+
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from niche_elf import ELFFile, datatypes, loaders
+from niche_elf.datatypes import Constants
+from niche_elf.structures import SymbolStore
+from niche_elf.update import SymbolChanges
+
+from . import workloads
+
+TRIALS = 500
+# Odds of a relocatable file, of sort_symbols and of a range section.
+FILE_OPTION_ODDS = 0.3
+# Odds of an upsert replacing a symbol that (probably) exists, and of it being local. Mostly
+# globals, so most updates take the fast path.
+EXISTING_ODDS = 0.7
+LOCAL_ODDS = 0.1
+# Name, value, size, bind, type.
+Row = tuple[bytes, int, int, int, int]
+# A name and the fields compared for it, see `entries`.
+Entry = tuple[bytes, int, int, int, int]
+
+
+def rows(store: SymbolStore) -> list[Row]:
+    return list(zip(store.raw_names(), store.value, store.size, store.bind, store.typ, strict=True))
+
+
+def model(before: list[Row], changes: SymbolChanges) -> list[Row]:
+    """Apply `changes` one symbol at a time, like `apply_changes` should."""
+    symbols = list(before)
+    dead = {
+        i
+        for i, (name, value, *_) in enumerate(symbols)
+        if name in changes.removed_names or value in changes.removed_addresses
+    }
+    key = 0 if changes.key == "name" else 1
+    for row in rows(changes.upserts):
+        matches = [i for i, old in enumerate(symbols) if i not in dead and old[key] == row[key]]
+        if not matches:
+            symbols.append(row)
+            continue
+        symbols[matches[0]] = row
+        dead.update(matches[1:])
+    return [row for i, row in enumerate(symbols) if i not in dead]
+
+
+def entries(image: bytes) -> tuple[list[Entry], list[Entry]]:
+    """Return the .symtab entries, with names instead of offsets, and the section headers."""
+    _, sections = loaders.elf_headers(image)
+    headers = dict(sections)
+    strtab = loaders.section_contents(image, headers[b".strtab"])
+    symtab = loaders.section_contents(image, headers[b".symtab"])
+    entsize = headers[b".symtab"].sh_entsize
+    result: list[Entry] = []
+    for offset in range(0, len(symtab), entsize):
+        entry = datatypes.ElfSym64.from_buffer_copy(symtab, offset)
+        name = strtab[entry.st_name : strtab.index(b"\0", entry.st_name)]
+        result.append((name, entry.st_value, entry.st_size, entry.st_info, entry.st_shndx))
+    layout: list[Entry] = [
+        (name, header.sh_type, header.sh_addr, header.sh_size, header.sh_info)
+        for name, header in sections
+        if name != b".strtab"
+    ]
+    return result, layout
+
+
+def random_file(rng: random.Random, path: Path) -> list[Row]:
+    elf = ELFFile(
+        0x400000,
+        relocatable=rng.random() < FILE_OPTION_ODDS,
+        sort_symbols=rng.random() < FILE_OPTION_ODDS,
+    )
+    if rng.random() < FILE_OPTION_ODDS:
+        elf.add_section("[m]", 0x800000, 0x900000)
+    for _ in range(rng.randrange(60)):
+        elf.store.append(
+            f"f{rng.randrange(40)}",
+            rng.choice([0x400000, 0x800100]) + rng.randrange(50) * 16,
+            rng.randrange(3) * 8,
+            rng.choice([Constants.STB_LOCAL, Constants.STB_GLOBAL]),
+            Constants.STT_FUNC,
+        )
+    elf.write(str(path))
+    store = SymbolStore()
+    loaders.load_elf(store, path)
+    return rows(store)
+
+
+def random_changes(rng: random.Random) -> SymbolChanges:
+    changes = SymbolChanges(key=rng.choice(["name", "address"]))
+    for _ in range(rng.randrange(6)):
+        changes.remove(f"f{rng.randrange(45)}")
+    for _ in range(rng.randrange(3)):
+        changes.remove_address(0x400000 + rng.randrange(50) * 16)
+    for _ in range(rng.randrange(10)):
+        changes.upsert(
+            f"f{rng.randrange(45)}" if rng.random() < EXISTING_ODDS else f"g{rng.randrange(5)}",
+            rng.choice([0x400000, 0x800100]) + rng.randrange(50) * 16,
+            rng.randrange(3) * 8,
+            Constants.STB_LOCAL if rng.random() < LOCAL_ODDS else Constants.STB_GLOBAL,
+            Constants.STT_FUNC,
+        )
+    return changes
+
+
+def check(directory: Path) -> None:
+    rng = random.Random(1)
+    old, new, fresh = directory / "old.elf", directory / "new.elf", directory / "fresh.elf"
+    rebuilds = 0
+    for trial in range(TRIALS):
+        before = random_file(rng, old)
+        changes = random_changes(rng)
+        expected = model(before, changes)
+        elf = ELFFile.update_from(old, changes, new)
+
+        store = SymbolStore()
+        loaders.load_elf(store, new)
+        # A rebuild lays the symbols out anew.
+        rebuilds += elf.sort_symbols
+        got, want = rows(store), expected
+        if elf.sort_symbols:
+            got, want = sorted(got), sorted(want)
+        if got != want:
+            raise AssertionError(f"Trial {trial}: wrong symbols {got} instead of {want}.")
+
+        reference = ELFFile(elf.textbase, sort_symbols=elf.sort_symbols)
+        reference.store = store
+        reference.ranges = elf.ranges
+        reference.write(str(fresh))
+        got_entries, got_layout = entries(new.read_bytes())
+        want_entries, want_layout = entries(fresh.read_bytes())
+        # The fast path only ever grows .text, a fresh build fits it to the remaining symbols.
+        text = [i for i, (name, *_) in enumerate(want_layout) if name == b".text"]
+        if text and got_layout[text[0]][3] >= want_layout[text[0]][3]:
+            got_layout[text[0]] = want_layout[text[0]]
+        if got_entries != want_entries or got_layout != want_layout:
+            raise AssertionError(f"Trial {trial}: the file differs from a fresh build.")
+
+    if not 0 < rebuilds < TRIALS:
+        raise AssertionError(f"Only one path was taken ({rebuilds} rebuilds of {TRIALS}).")
+    print(f"{TRIALS} random updates match, {rebuilds} of them rebuilt the file")
+
+
+def timing(directory: Path) -> None:
+    count = 1_000_000
+    symbols = workloads.decompiler(count)
+    elf = ELFFile(workloads.BINARY_TEXT)
+    elf.add_symbols_bulk(symbols.names, symbols.addrs, symbols.sizes, types=Constants.STT_FUNC)
+    path = str(directory / "big.elf")
+    elf.write(path)
+
+    # Renames of every thousandth symbol from a decompiler, and a few new ones.
+    changes = SymbolChanges(key="address")
+    for i in range(0, count, 1000):
+        changes.upsert(f"renamed_{i}", symbols.addrs[i], symbols.sizes[i])
+    for i in range(500):
+        changes.upsert(f"new_{i}", 0x10000000 + i * 16, 16)
+
+    start = time.perf_counter()
+    updated = ELFFile.update_from(path, changes, directory / "updated.elf")
+    update_time = time.perf_counter() - start
+    start = time.perf_counter()
+    updated.write(str(directory / "full.elf"))
+    write_time = time.perf_counter() - start
+    print(
+        f"{len(changes.upserts)} changes to {count} symbols: update_from {update_time * 1000:.1f}"
+        f" ms, full write {write_time * 1000:.1f} ms",
+    )
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        check(Path(tmp))
+        timing(Path(tmp))
+
+
+if __name__ == "__main__":
+    main()
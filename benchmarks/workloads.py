@@ -0,0 +1,120 @@
+"""
+Synthetic symbol sets shaped like the real inputs.
+
+`kallsyms` mimics a `/proc/kallsyms` dump: subsystem-prefixed snake_case names (4 to ~60
+characters), GCC clone suffixes, a few percent duplicated static symbols, the usual mix of type
+letters, and module symbols with a `[module]` column at the end. `decompiler` mimics what a
+decompiler exports: mostly auto-generated `FUN_`/`DAT_`/`sub_` names, some recovered names, and
+real sizes.
+"""
+
+from __future__ import annotations
+
+import operator
+import random
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate, pairwise
+
+KERNEL_TEXT = 0xFFFFFFFF81000000
+MODULES_BASE = 0xFFFFFFFFC0000000
+BINARY_TEXT = 0x400000
+
+PREFIXES = [
+    prefix if prefix.endswith("_") else prefix + "_"
+    for prefix in (
+        "acpi arch bpf blk cgroup clk cpu crypto dev devm dma drm ext4 fs hrtimer i915 inet ip "
+        "ipv6 irq kernfs kvm mm mmc net nfs nvme of pci perf pm rcu regmap sched scsi security sk "
+        "skb snd sock sys tcp tty udp usb vfs virtio x86 xfs __ ___ do_ __se_sys __x64_sys"
+    ).split()
+]
+WORDS = (
+    "alloc free init exit get put read write open release lock unlock handler update create "
+    "destroy start stop show store probe remove suspend resume map unmap queue work event entry "
+    "state buffer page cache table info ops core common flush sync timer wake wait check find set "
+    "clear register unregister attach detach enable disable config reset irq poll send recv"
+).split()
+# How many words follow the prefix, in percent of names. Averages ~20 characters per name.
+WORD_COUNT_WEIGHTS = {1: 15, 2: 40, 3: 35, 4: 10}
+CLONE_SUFFIXES = (".cold", ".constprop.0", ".isra.0", ".part.0", ".llvm.1234567890123")
+MODULES = "ext4 kvm kvm_intel xfs btrfs nf_tables i915 snd_hda_intel e1000e nvme".split()
+
+# Share of each type letter in a distro kernel's kallsyms.
+TYPE_LETTERS = "TtDdBbRrW"
+TYPE_WEIGHTS = (35, 40, 3, 7, 1, 4, 3, 5, 2)
+
+# Distance between consecutive symbols.
+GAPS = (0x10, 0x20, 0x40, 0x80, 0x100, 0x200, 0x1000)
+GAP_WEIGHTS = (30, 25, 20, 12, 8, 4, 1)
+
+DUPLICATE_RATE = 0.03
+CLONE_RATE = 0.03
+MODULE_RATE = 0.1
+
+
+def _names(rng: random.Random, count: int) -> list[str]:
+    """Return `count` kernel-style names, `DUPLICATE_RATE` of them repeated."""
+    names: dict[str, None] = {}
+    while len(names) < count:
+        missing = count - len(names)
+        for words, weight in WORD_COUNT_WEIGHTS.items():
+            k = missing * weight // 100 + 1
+            prefixes = rng.choices(PREFIXES, k=k)
+            tails = map(
+                "_".join,
+                zip(*(rng.choices(WORDS, k=k) for _ in range(words)), strict=True),
+            )
+            names.update(dict.fromkeys(map(operator.add, prefixes, tails)))
+
+    # Dicts keep insertion order, which is already random.
+    result = list(names)[:count]
+    for i in rng.sample(range(count), int(count * CLONE_RATE)):
+        result[i] += rng.choice(CLONE_SUFFIXES)
+    # Static symbols with the same name in different files.
+    for i in rng.sample(range(count), int(count * DUPLICATE_RATE)):
+        result[i] = result[rng.randrange(count)]
+    return result
+
+
+def _addresses(rng: random.Random, start: int, count: int) -> array[int]:
+    return array("Q", accumulate(rng.choices(GAPS, GAP_WEIGHTS, k=count), initial=start))[:-1]
+
+
+def kallsyms(count: int, seed: int = 0) -> bytes:
+    """Return a `/proc/kallsyms` style listing of `count` symbols."""
+    rng = random.Random(seed)
+    names = _names(rng, count)
+    letters = rng.choices(TYPE_LETTERS, TYPE_WEIGHTS, k=count)
+
+    module_count = int(count * MODULE_RATE)
+    core_count = count - module_count
+    addrs = _addresses(rng, KERNEL_TEXT, core_count)
+    addrs += _addresses(rng, MODULES_BASE, module_count)
+    modules = [""] * core_count + sorted(
+        f"\t[{module}]" for module in rng.choices(MODULES, k=module_count)
+    )
+
+    lines = map("{:016x} {} {}{}\n".format, addrs, letters, names, modules)
+    return "".join(lines).encode()
+
+
+@dataclass
+class DecompilerSymbols:
+    names: list[str]
+    addrs: array[int]
+    sizes: array[int]
+
+
+def decompiler(count: int, seed: int = 0) -> DecompilerSymbols:
+    """Return `count` symbols as exported by a decompiler for a big stripped binary."""
+    rng = random.Random(seed)
+    addrs = _addresses(rng, BINARY_TEXT, count)
+    sizes = array("Q", [nxt - cur for cur, nxt in pairwise(addrs)] + [0x10])
+
+    auto = rng.choices(("FUN_{:08x}", "DAT_{:08x}", "sub_{:x}", "LAB_{:08x}"), k=count)
+    names = list(map(str.format, auto, addrs))
+    # Names recovered from strings, RTTI, signatures, or typed in by the user.
+    recovered = _names(rng, count // 5)
+    for i, name in zip(rng.sample(range(count), len(recovered)), recovered, strict=True):
+        names[i] = name
+    return DecompilerSymbols(names, addrs, sizes)
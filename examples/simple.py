@@ -4,6 +4,8 @@ elf = ELFFile(0)
 elf.add_generic_symbol("mycoolsymbol", 0x1330)
 elf.add_function("mycoolhandler", 0x1370)
 elf.add_object("mycoolvariable", 0x1480)
+# When you have a lot of symbols, add them column-wise in one call instead.
+elf.add_symbols_bulk(["mycoolsymbol2", "mycoolsymbol3"], [0x1500, 0x1510])
 elf.write("symbols.o")
 
 # Here is how the pwndbg decompiler integration code uses it
@@ -38,3 +40,17 @@ for sym_name, sym_type, sym_addr in syms:
 elf.write(elf_path)
 pwndbg.dbg.selected_inferior().add_symbol_file(elf_path, base)
 """
+
+# If you have the kallsyms dump at hand, niche-elf can parse it in bulk, applying the same
+# bind and type classification as above:
+"""
+elf = niche_elf.ELFFile.from_kallsyms(kallsyms_bytes, base)
+elf.write(elf_path)
+"""
+
+# To skip the filesystem entirely (Linux), write into a memfd instead of a temporary file:
+"""
+fd, elf_path = elf.write_memfd()
+inf.add_symbol_file(elf_path, base)
+os.close(fd)
+"""
@@ -3,7 +3,7 @@
 set -o errexit
 set -o xtrace
 
-LINT_FILES="niche_elf examples"
+LINT_FILES="niche_elf examples benchmarks"
 
 uv run ruff format $LINT_FILES
 uv run ruff check --fix --output-format=full $LINT_FILES
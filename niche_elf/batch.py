@@ -0,0 +1,96 @@
+"""Builds many symbol files at once, e.g. one per kernel module."""
+
+from __future__ import annotations
+
+import copy
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from . import shards
+from .stats import BuildStats
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
+
+    from . import loaders
+    from .elf import ELFFile
+
+
+@dataclass
+class BatchResult:
+    # Output file of every module.
+    paths: dict[str, str]
+    # Phase times of every module's build, see `BuildStats`.
+    stats: dict[str, BuildStats]
+    # Wall time of the whole batch, in seconds.
+    elapsed: float
+
+    @property
+    def timings(self) -> dict[str, float]:
+        """Total build time of every module, in seconds."""
+        return {name: sum(stats.phases.values()) for name, stats in self.stats.items()}
+
+
+def _build(path: str, elf: ELFFile) -> BuildStats:
+    """Write a single module's file. Runs in the executor."""
+    # A thread pool shares `elf` with the caller.
+    elf = copy.copy(elf)
+    elf.stats = stats = BuildStats()
+    elf.write(path)
+    return stats
+
+
+def build_batch(
+    modules: Mapping[str, ELFFile],
+    directory: str | os.PathLike[str],
+    *,
+    workers: int | None = None,
+    executor: Executor | None = None,
+) -> BatchResult:
+    """
+    Write one ELF file per module (to `directory`/`name`.elf), building them concurrently.
+
+    `modules` maps each name to its file, with its own options and range sections (see
+    `ELFFile.add_section`). The builds run in `executor`, or by default in a pool of `workers`
+    processes (`os.cpu_count()` if not given). A `ThreadPoolExecutor` avoids sending the symbols
+    to other processes, but the builds then mostly take turns holding the GIL.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {name: str(directory / f"{name}.elf") for name in modules}
+
+    start = time.perf_counter()
+    pool = executor or ProcessPoolExecutor(workers or os.cpu_count())
+    try:
+        futures = {name: pool.submit(_build, paths[name], elf) for name, elf in modules.items()}
+        stats = {name: future.result() for name, future in futures.items()}
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    return BatchResult(paths, stats, time.perf_counter() - start)
+
+
+def build_kallsyms_modules(
+    source: loaders.Source,
+    textbase: int,
+    directory: str | os.PathLike[str],
+    *,
+    relocatable: bool = False,
+    workers: int | None = None,
+    executor: Executor | None = None,
+) -> BatchResult:
+    """
+    Parse a `/proc/kallsyms` style listing once, and write a file per module with `build_batch`.
+
+    The kernel itself is "vmlinux", see `shards.split_by_module`. Modules interleaved with other
+    modules keep their range sections, so the files' sections don't overlap.
+    """
+    modules = shards.split_by_module(source, textbase)
+    for elf in modules.values():
+        elf.relocatable = relocatable
+    return build_batch(modules, directory, workers=workers, executor=executor)
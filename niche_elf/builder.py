@@ -1,10 +1,30 @@
 """Handles crafting a minimal ELF file using structured classes."""
 
+from __future__ import annotations
+
+import bisect
 import ctypes
+import dataclasses
+import operator
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress, repeat
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+from . import datatypes, symtab
+from .stats import BuildStats, phase
+from .structures import Section, StrTab, Symbol, SymbolStore, rebased
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
 
-from . import datatypes
-from .structures import Section, SHStrTab, Symbol
+
+# Below this, starting the worker processes costs more than the packing itself.
+PARALLEL_MIN_SYMBOLS: int = 1 << 20
+
+# Section index of .text, see `add_text_section`.
+TEXT_INDEX: int = 1
 
 
 def align(offset: int, alignment: int) -> int:
@@ -16,7 +36,20 @@ def align(offset: int, alignment: int) -> int:
 class ELFBuilder:
     """Main ELF file builder."""
 
-    def __init__(self, e_machine: int, ptrbits: int) -> None:
+    def __init__(
+        self,
+        e_machine: int,
+        ptrbits: int,
+        backend: symtab.Backend = "array",
+        workers: int = 1,
+        stats: BuildStats | None = None,
+    ) -> None:
+        """
+        Initialize an empty ELF file.
+
+        With `workers` > 1, big symbol tables are packed in that many processes (see
+        `pack_symtab_parallel`). If `stats` is given, phase times and counters are recorded in it.
+        """
         if ptrbits not in {32, 64}:
             raise AssertionError(f"ptrbits must be 32 or 64, but is {ptrbits}")
 
@@ -26,6 +59,11 @@ class ELFBuilder:
         self.ElfSym = {32: datatypes.ElfSym32, 64: datatypes.ElfSym64}[ptrbits]
         # self.ElfRel = {32: datatypes.ElfRel32, 64: datatypes.ElfRel64}[ptrsize]
         # self.ElfLinkMap = {32: datatypes.ElfLinkMap32, 64: datatypes.ElfLinkMap64}[ptrsize]
+        self.backend: symtab.Backend = backend
+        self.workers: int = workers
+        self.ptrbits: int = ptrbits
+        self.addr_mask: int = (1 << ptrbits) - 1
+        self.stats: BuildStats | None = stats
 
         self.e_ident = (
             b"\x7fELF"
@@ -69,7 +107,13 @@ class ELFBuilder:
             ),
         )
         self.sections: list[Section] = [null_section]
-        self.shstrtab = SHStrTab()
+        self.shstrtab = StrTab()
+        # Sorted start and end addresses of the ranges added with `add_range_section`, and the
+        # section index for a `bisect_right` into them (.text outside of all ranges).
+        self.range_bounds: list[int] = []
+        self.range_indices: list[int] = [TEXT_INDEX]
+        # Set by `add_symbols`.
+        self.symtab_index: int = -1
 
     def add_text_section(self, addr: int) -> None:
         name_offset = self.shstrtab.add(".text")
@@ -91,49 +135,163 @@ class ELFBuilder:
         )
         self.sections.append(sec)
 
-    def add_symbols(self, symbols: list[Symbol]) -> None:
-        strtab = b"\x00"
-        name_offsets = {}
-        max_addr: int = 0
-        for s in symbols:
-            name_offsets[s.name] = len(strtab)
-            strtab += s.name.encode() + b"\x00"
-            max_addr = max(max_addr, s.value + s.size)
-
-        # Fix .text section size so examining in GDB works properly.
-        # We do +1 to cover the last symbol even if its size=0.
-        # Note that this may be bigger than the .text section of the loaded objfile we are trying to
-        # symbolicate (e.g. it may include the .data and .bss sections), it doesn't matter.
-        self.sections[1].header.sh_size = max_addr + 1 - self.sections[1].header.sh_addr
-
-        symtab_entries = [
-            self.ElfSym(
-                st_name=0,
-                st_value=0,
-                st_size=0,
-                bind=0,
-                typ=0,
-                st_other=0,
-                st_shndx=0,
+    def add_range_section(self, name: str, start: int, end: int) -> None:
+        """
+        Add a NOBITS section covering [start, end), e.g. for a kernel module.
+
+        Symbols inside the range are placed in this section instead of .text. Must be called
+        after `add_text_section` and before `add_symbols`, ranges may not overlap.
+        """
+        if not start < end:
+            raise ValueError(f"Section {name} has an empty range ({start:#x} to {end:#x}).")
+        pos = bisect.bisect_right(self.range_bounds, start)
+        if pos % 2 or (pos < len(self.range_bounds) and self.range_bounds[pos] < end):
+            raise ValueError(f"Section {name} ({start:#x} to {end:#x}) overlaps another one.")
+
+        self.range_bounds[pos:pos] = [start, end]
+        self.range_indices[pos + 1 : pos + 1] = [len(self.sections), TEXT_INDEX]
+
+        sec = Section(
+            name=name,
+            data=b"",
+            header=self.ElfShdr(
+                sh_name=self.shstrtab.add(name),
+                sh_type=datatypes.Constants.SHT_NOBITS,
+                sh_flags=datatypes.Constants.SHF_ALLOC | datatypes.Constants.SHF_EXECINSTR,
+                sh_addr=start,
+                sh_size=end - start,
+                sh_link=0,
+                sh_info=0,
+                sh_addralign=0x10,
+                sh_entsize=0,
+                sh_offset=-1,  # Fixed later.
             ),
-        ] + [
-            self.ElfSym(
-                st_name=name_offsets[s.name],
-                st_value=s.value,
-                st_size=s.size,
-                bind=s.bind,
-                typ=s.typ,
-                st_other=0,
-                st_shndx=1,  # Sucks that we are hardcoding, this is .text
-            )
-            for s in symbols
-        ]
+        )
+        self.sections.append(sec)
+
+    def section_indices(self, values: Iterable[int]) -> array[int]:
+        """Return the `st_shndx` of symbols at `values`: their range section, or .text."""
+        if not self.range_bounds:
+            values = values if isinstance(values, array) else list(values)
+            return array("H", [TEXT_INDEX]) * len(values)
+        positions = map(bisect.bisect_right, repeat(self.range_bounds), values)
+        return array("H", map(self.range_indices.__getitem__, positions))
+
+    def add_symbols(
+        self,
+        symbols: Iterable[Symbol] | SymbolStore,
+        *,
+        merge_strings: bool = False,
+        spare_symbols: int = 0,
+        spare_strtab: int = 0,
+        base: int = 0,
+        infer_sizes: bool = False,
+    ) -> None:
+        """
+        Add the .symtab and .strtab sections.
+
+        `spare_symbols` entries and `spare_strtab` bytes are reserved after the respective
+        section in the file, see `IncrementalWriter`. `base` is subtracted from every symbol
+        value, for relocatable files (see `ELFFile.relocatable`). With `infer_sizes`, symbols
+        without a size get one from `inferred_sizes`.
+        """
+        store = symbols if isinstance(symbols, SymbolStore) else SymbolStore.from_symbols(symbols)
+        if self.stats is not None:
+            names = store.raw_names()
+            self.stats.symbols += len(names)
+            self.stats.duplicates += len(names) - len(set(names))
+
+        strtab = store.strtab
+        st_name = store.name
+        if merge_strings:
+            with phase(self.stats, "strtab"):
+                strtab, st_name = StrTab.merged(store.raw_names())
+
+        with phase(self.stats, "symtab"):
+            values = store.value
+            if base:
+                values = rebased(values, -base, self.addr_mask)
+
+            st_shndx = self.section_indices(values)
+            if infer_sizes:
+                sizes = self.inferred_sizes(values, store.size, st_shndx)
+                if sizes is not store.size:
+                    store = dataclasses.replace(store, size=sizes)
+            ends: Iterable[int] = map(operator.add, values, store.size)
+            if self.range_bounds:
+                # Symbols of the other sections don't count towards .text.
+                ends = compress(ends, map(TEXT_INDEX.__eq__, st_shndx))
+            text = self.sections[TEXT_INDEX].header
+            max_addr: int = max(ends, default=text.sh_addr)
+
+            # Fix .text section size so examining in GDB works properly.
+            # We do +1 to cover the last symbol even if its size=0.
+            # Note that this may be bigger than the .text section of the loaded objfile we are
+            # trying to symbolicate (e.g. it may include the .data and .bss sections), it doesn't
+            # matter.
+            text.sh_size = max_addr + 1 - text.sh_addr
 
+            symtab_data = self.pack_symtab(store, st_name, values, st_shndx)
+
+        local_count = store.local_count()
+        self.add_symbol_sections(
+            symtab_data,
+            strtab.data,
+            # Unless the locals come first (see `SymbolStore.laid_out`) no value is right. 1
+            # claims there are none, which GDB doesn't mind.
+            first_global=1 if local_count is None else local_count + 1,
+            spare_symbols=spare_symbols,
+            spare_strtab=spare_strtab,
+        )
+
+    def inferred_sizes(
+        self,
+        values: array[int],
+        sizes: array[int],
+        st_shndx: array[int],
+    ) -> array[int]:
+        """
+        Return `sizes` with each 0 replaced by the distance to the next higher symbol address.
+
+        Where that address is in another section (see `section_indices`) the size stays 0, as
+        it does for the symbols at the highest address. Returns `sizes` itself if it has no 0.
+        """
+        if not sizes.count(0):
+            return sizes
+
+        # Sorting first is cheaper than a set, since the values are often mostly in order.
+        addrs = list(dict.fromkeys(sorted(values)))
+        last = len(addrs) - 1
+        # The highest address is its own next one, giving it a distance of 0.
+        positions = map(bisect.bisect_right, repeat(addrs), values, repeat(0), repeat(last))
+        nexts = array("Q", map(addrs.__getitem__, positions))
+        distances: Iterable[int] = map(operator.sub, nexts, values)
+        if self.range_bounds:
+            same_section = map(operator.eq, st_shndx, self.section_indices(nexts))
+            distances = map(operator.mul, distances, same_section)
+        # size + distance * (size == 0)
+        unsized = map(operator.not_, sizes)
+        return array("Q", map(operator.add, sizes, map(operator.mul, distances, unsized)))
+
+    def add_symbol_sections(
+        self,
+        symtab_data: bytes | bytearray,
+        strtab_data: bytes | bytearray,
+        *,
+        first_global: int = 1,
+        spare_symbols: int = 0,
+        spare_strtab: int = 0,
+    ) -> None:
+        """
+        Add .symtab and .strtab with already packed contents, see `add_symbols`.
+
+        `first_global` is the index of the first non-local entry, counting the NULL entry.
+        """
         # We add symtab then strtab,
         # so the strtab index = len(self.sections) - 1 + 2
+        self.symtab_index = len(self.sections)
         strtab_index = len(self.sections) + 1
 
-        symtab_data = b"".join(bytes(e) for e in symtab_entries)
         symtab_name_offset = self.shstrtab.add(".symtab")
         symtab_sec = Section(
             name=".symtab",
@@ -148,56 +306,179 @@ class ELFBuilder:
                 # See System V specific part of ELF.
                 # > A symbol table section's sh_info section header member holds
                 # > the symbol table index for the first non-local symbol.
-                # FIXME: Check does GDB actually look at this?
-                sh_info=1,
+                sh_info=first_global,
                 sh_addralign=8,
                 # Fucking crucial, or you'll fail a check in GDB's bfd/elf.c:bfd_section_from_shdr
                 # if (hdr->sh_entsize != bed->s->sizeof_sym)
                 sh_entsize=ctypes.sizeof(self.ElfSym),
                 sh_offset=-1,
             ),
+            reserved=spare_symbols * ctypes.sizeof(self.ElfSym),
         )
         self.sections.append(symtab_sec)
 
         strtab_name_offset = self.shstrtab.add(".strtab")
         strtab_sec = Section(
             name=".strtab",
-            data=strtab,
+            data=strtab_data,
             header=self.ElfShdr(
                 sh_name=strtab_name_offset,
                 sh_type=datatypes.Constants.SHT_STRTAB,
                 sh_flags=0,
                 sh_addr=0,
-                sh_size=len(strtab),
+                sh_size=len(strtab_data),
                 sh_link=0,
                 sh_info=0,
                 sh_addralign=1,
                 sh_entsize=0,
                 sh_offset=-1,
             ),
+            reserved=spare_strtab,
         )
         self.sections.append(strtab_sec)
 
-    def write(self, path: str) -> None:
+    def pack_symtab(
+        self,
+        store: SymbolStore,
+        st_name: Iterable[int],
+        st_value: Iterable[int],
+        st_shndx: array[int] | None = None,
+    ) -> bytes | bytearray:
+        """
+        Serialize .symtab (including the NULL entry) with the configured backend.
+
+        `st_shndx` is looked up with `section_indices` if not given.
+        """
+        if st_shndx is None:
+            st_value = st_value if isinstance(st_value, array) else array("Q", st_value)
+            st_shndx = self.section_indices(st_value)
+
+        if self.backend == "ctypes":
+            return self.pack_symtab_ctypes(store, st_name, st_value, st_shndx)
+
+        if self.workers > 1 and len(store) >= PARALLEL_MIN_SYMBOLS:
+            return self.pack_symtab_parallel(store, st_name, st_value, st_shndx)
+
+        return symtab.pack_symbols(
+            self.ElfSym,
+            st_name=st_name,
+            st_value=st_value,
+            st_shndx=st_shndx,
+            st_size=store.size,
+            bind=store.bind,
+            typ=store.typ,
+        )
+
+    def pack_symtab_parallel(
+        self,
+        store: SymbolStore,
+        st_name: Iterable[int],
+        st_value: Iterable[int],
+        st_shndx: array[int],
+    ) -> bytearray:
+        """
+        Serialize .symtab in `workers` processes, each packing a contiguous range of symbols.
+
+        Names already have their final .strtab offsets, so the chunks are independent and are
+        just copied into place. The result is identical to the serial path.
+        """
+        names = st_name if isinstance(st_name, array) else array("I", st_name)
+        values = st_value if isinstance(st_value, array) else array("Q", st_value)
+        count = len(store)
+        chunk = -(-count // self.workers)
+        entsize = ctypes.sizeof(self.ElfSym)
+
+        data = bytearray(entsize * (count + 1))
+        with ProcessPoolExecutor(self.workers) as pool:
+            futures = [
+                pool.submit(
+                    symtab.pack_chunk,
+                    self.ptrbits,
+                    st_name=names[start : start + chunk],
+                    st_value=values[start : start + chunk],
+                    st_shndx=st_shndx[start : start + chunk],
+                    st_size=store.size[start : start + chunk],
+                    bind=store.bind[start : start + chunk],
+                    typ=store.typ[start : start + chunk],
+                )
+                for start in range(0, count, chunk)
+            ]
+            # The NULL entry comes first.
+            offset = entsize
+            for future in futures:
+                packed = future.result()
+                data[offset : offset + len(packed)] = packed
+                offset += len(packed)
+
+        return data
+
+    def pack_symtab_ctypes(
+        self,
+        store: SymbolStore,
+        st_name: Iterable[int],
+        st_value: Iterable[int],
+        st_shndx: Iterable[int],
+    ) -> bytes:
+        """Serialize .symtab through ctypes, the reference the "array" backend must match."""
+        entries = [
+            self.ElfSym(
+                st_name=0,
+                st_value=0,
+                st_size=0,
+                bind=0,
+                typ=0,
+                st_other=0,
+                st_shndx=0,
+            ),
+        ] + [
+            self.ElfSym(
+                st_name=name_offset,
+                st_value=value,
+                st_size=st_size,
+                bind=bind,
+                typ=typ,
+                st_other=0,
+                st_shndx=shndx,
+            )
+            for name_offset, value, shndx, st_size, bind, typ in zip(
+                st_name,
+                st_value,
+                st_shndx,
+                store.size,
+                store.bind,
+                store.typ,
+                strict=True,
+            )
+        ]
+
+        return b"".join(bytes(e) for e in entries)
+
+    def layout(self) -> tuple[list[Section], int]:
+        """
+        Assign the section offsets and add .shstrtab.
+
+        Returns all sections, including .shstrtab, and the offset of the section header table.
+        """
         offset = 64  # ELF header size
 
         # Fix section offsets now. (but skip the NULL section)
         for sec in self.sections[1:]:
             offset = align(offset, sec.header.sh_addralign)
             sec.header.sh_offset = offset
-            offset += len(sec.padded_data())
+            offset += align(len(sec.data) + sec.reserved, sec.header.sh_addralign)
 
         shstrtab_sec_name_offset: int = self.shstrtab.add(".shstrtab")
+        shstrtab_data = self.shstrtab.data
         shstrtab_sec = Section(
             name=".shstrtab",
-            data=self.shstrtab.data,
+            data=shstrtab_data,
             header=self.ElfShdr(
                 sh_name=shstrtab_sec_name_offset,
                 sh_type=datatypes.Constants.SHT_STRTAB,
                 sh_flags=0,
                 sh_addr=0,
                 sh_offset=offset,
-                sh_size=len(self.shstrtab.data),
+                sh_size=len(shstrtab_data),
                 sh_link=0,
                 sh_info=0,
                 sh_addralign=1,
@@ -206,11 +487,10 @@ class ELFBuilder:
         )
         offset += len(shstrtab_sec.data)
 
-        shoff = align(offset, 8)
-        shnum = len(self.sections) + 1  # all + shstrtab
-        shstrndx = shnum - 1
+        return [*self.sections, shstrtab_sec], align(offset, 8)
 
-        header = self.ElfEhdr(
+    def elf_header(self, shoff: int, shnum: int) -> ctypes.Structure:
+        return self.ElfEhdr(
             e_ident=self.e_ident,
             e_type=datatypes.Constants.ET_EXEC,
             e_machine=self.e_machine,
@@ -224,22 +504,46 @@ class ELFBuilder:
             e_phnum=0,
             e_shentsize=ctypes.sizeof(self.ElfShdr),
             e_shnum=shnum,
-            e_shstrndx=shstrndx,
+            # .shstrtab is always last.
+            e_shstrndx=shnum - 1,
         )
 
-        with Path(path).open("wb") as f:
-            f.write(bytes(header))
+    def build(self) -> bytearray:
+        """
+        Lay out the whole file and return its contents.
 
-            # write sections (but skip the NULL section)
-            for sec in self.sections[1:]:
-                f.seek(sec.header.sh_offset)
-                f.write(sec.padded_data())
+        The final size is computed up front, and the header, section contents and section
+        headers are copied straight into a single preallocated buffer.
+        """
+        with phase(self.stats, "layout"):
+            sections, shoff = self.layout()
+            shnum = len(sections)
+            shentsize = ctypes.sizeof(self.ElfShdr)
+            header = self.elf_header(shoff, shnum)
 
-            # write shstrtab
-            f.seek(shstrtab_sec.header.sh_offset)
-            f.write(shstrtab_sec.data)
+        if self.stats is not None:
+            for sec in sections[1:]:
+                self.stats.section_bytes[sec.name] = len(sec.data) + sec.reserved
 
-            # write section headers
-            f.seek(shoff)
-            for sec in [*self.sections, shstrtab_sec]:
-                f.write(sec.packed_header())
+        with phase(self.stats, "assemble"):
+            image = bytearray(shoff + shnum * shentsize)
+            view = memoryview(image)
+            view[: ctypes.sizeof(header)] = memoryview(header).cast("B")
+
+            # The padding between sections is already zero. (but skip the NULL section)
+            for sec in sections[1:]:
+                view[sec.header.sh_offset : sec.header.sh_offset + len(sec.data)] = sec.data
+
+            for i, sec in enumerate(sections):
+                start = shoff + i * shentsize
+                view[start : start + shentsize] = sec.packed_header()
+
+        return image
+
+    def write(self, path: str) -> None:
+        image = self.build()
+        # One write for the whole file.
+        with phase(self.stats, "io"):
+            Path(path).write_bytes(image)
+        if self.stats is not None:
+            self.stats.syscalls += 3  # open, write, close
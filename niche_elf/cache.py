@@ -0,0 +1,139 @@
+"""A content-addressed on-disk cache of generated ELF files."""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .structures import rebased
+from .util import write_atomic, zig_target_arch_to_elf
+
+if TYPE_CHECKING:
+    from .elf import ELFFile
+
+# Bump when the emitted files change, so stale entries are never returned.
+FORMAT_VERSION = 2
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def default_directory() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "niche-elf"
+
+
+def fingerprint(elf: ELFFile) -> str:
+    """
+    Return a hash of everything that goes into the file `elf` would write.
+
+    Relocatable files don't depend on `textbase`, so the same symbols at another slide (e.g.
+    a different KASLR run) give the same hash.
+    """
+    store = elf.store
+    values = store.value
+    textbase: int | None = elf.textbase
+    ranges = sorted(elf.ranges.items())
+    if elf.relocatable:
+        values = rebased(values, -elf.textbase)
+        textbase = None
+        ranges = [
+            (name, (start - elf.textbase, end - elf.textbase)) for name, (start, end) in ranges
+        ]
+
+    digest = hashlib.blake2b(digest_size=20)
+    header = (
+        FORMAT_VERSION,
+        textbase,
+        elf.ptrsize,
+        zig_target_arch_to_elf(elf.zig_target_arch),
+        elf.merge_strings,
+        elf.relocatable,
+        elf.sort_symbols,
+        elf.infer_sizes,
+        len(store),
+        ranges,
+    )
+    digest.update(repr(header).encode())
+
+    for column in (
+        store.strtab.data,
+        store.name,
+        values,
+        store.size,
+        store.bind,
+        store.typ,
+    ):
+        digest.update(column)
+    return digest.hexdigest()
+
+
+class SymbolCache:
+    """
+    A size-bounded directory of ELF files, keyed by a hash of everything that goes into them.
+
+    Hashing the symbol columns is a single pass over a few contiguous buffers, so a hit costs
+    a few milliseconds even for a whole kernel. Entries are evicted least recently used first
+    (by mtime, which a hit refreshes) once the directory grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str] | None = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        self.directory = Path(directory) if directory is not None else default_directory()
+        self.max_bytes = max_bytes
+
+    def key(self, elf: ELFFile) -> str:
+        """Return the cache key of the file `elf` would write, see `fingerprint`."""
+        return fingerprint(elf)
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.elf"
+
+    def get(self, elf: ELFFile) -> str | None:
+        """Return the path of the cached file for `elf`, or None."""
+        path = self.path(self.key(elf))
+        try:
+            # Mark it as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return str(path)
+
+    def put(self, elf: ELFFile) -> str:
+        """Build the file for `elf`, store it and return its path."""
+        # Keyed like `get`, before anything the build might do to `elf`.
+        path = self.path(self.key(elf))
+        image = elf.build()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Another process may be reading (or writing) the same entry.
+        write_atomic(path, image)
+
+        self.evict(keep=path)
+        return str(path)
+
+    def write(self, elf: ELFFile) -> str:
+        """Return the path of the file for `elf`, building it only if it isn't cached."""
+        return self.get(elf) or self.put(elf)
+
+    def evict(self, keep: Path | None = None) -> None:
+        """Delete the least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for path in self.directory.glob("*.elf"):
+            with contextlib.suppress(FileNotFoundError):
+                entries.append((path.stat(), path))
+
+        total = sum(stat.st_size for stat, _ in entries)
+        for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime_ns):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+            total -= stat.st_size
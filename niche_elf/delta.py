@@ -0,0 +1,54 @@
+"""Compares symbol sets, so only what changed between two writes has to be emitted."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TypeAlias
+
+from .structures import Symbol, SymbolStore
+
+# Everything that ends up in a symbol's .symtab entry: (name, value, size, bind, typ).
+Record: TypeAlias = tuple[bytes, int, int, int, int]
+
+
+@dataclass
+class SymbolDelta:
+    """The result of `ELFFile.write_delta`."""
+
+    # The supplementary ELF file, None if no symbol was added or changed (only removed).
+    path: str | None
+    # How many symbols `path` contains, new ones and the new versions of changed ones.
+    written: int
+    # Previously emitted symbols that no longer exist, including the old versions of changed
+    # symbols.
+    removed: list[Symbol]
+
+
+def records(store: SymbolStore) -> list[Record]:
+    return list(zip(store.raw_names(), store.value, store.size, store.bind, store.typ, strict=True))
+
+
+def diff(old: SymbolStore, new: SymbolStore) -> tuple[SymbolStore, list[Symbol]]:
+    """
+    Compare two symbol sets.
+
+    Returns a store with the symbols of `new` that are not in `old`, and the symbols of `old`
+    that are not in `new`. A symbol whose address, size, bind or type changed is in both.
+    """
+    old_records = records(old)
+    new_records = records(new)
+    old_set = set(old_records)
+    new_set = set(new_records)
+
+    added = SymbolStore()
+    fresh = [record for record in new_records if record not in old_set]
+    if fresh:
+        names, values, sizes, binds, types = zip(*fresh, strict=True)
+        added.extend(names, values, sizes, binds, types)
+
+    removed = [
+        Symbol(name=name.decode(), bind=bind, typ=typ, value=value, size=size)
+        for name, value, size, bind, typ in old_records
+        if (name, value, size, bind, typ) not in new_set
+    ]
+    return added, removed
@@ -1,23 +1,78 @@
 """The main library entrypoint."""
 
-from . import datatypes
+from __future__ import annotations
+
+import asyncio
+import copy
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, TYPE_CHECKING
+
+from . import datatypes, delta, loaders, shards, update
 from .builder import ELFBuilder
-from .structures import Symbol
+from .cache import SymbolCache
+from .incremental import IncrementalWriter
+from .stats import BuildStats, phase
+from .structures import U64_MASK, Column, SymbolStore, SymbolView
 from .util import zig_target_arch_to_elf
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
 DEFAULT_BIND: int = datatypes.Constants.STB_GLOBAL
 
+# Runs `ELFFile.write_future` when no executor is passed. One thread, so the writes happen in the
+# order they were requested.
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _default_executor() -> ThreadPoolExecutor:
+    global _executor  # noqa: PLW0603
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="niche-elf")
+        return _executor
+
+
+def _write(elf: ELFFile, path: str) -> str:
+    elf.write(path)
+    return path
+
 
 class ELFFile:
     """Represents an ELF file (public API)."""
 
-    def __init__(self, textbase: int) -> None:
+    def __init__(
+        self,
+        textbase: int,
+        *,
+        merge_strings: bool = False,
+        relocatable: bool = False,
+        sort_symbols: bool = False,
+        infer_sizes: bool = False,
+        workers: int = 1,
+        stats: BuildStats | None = None,
+    ) -> None:
         """
         Initialize an ELF file.
 
         Arguments:
             textbase: The Virtual Memory Address of the .text section of the file we are
                 trying to symbolicate. (there does not need to be an actual ".text" section there)
+            merge_strings: Deduplicate and tail-merge the names in .strtab. Makes the file
+                smaller at the cost of a sort over all names when writing.
+            relocatable: Emit symbol values relative to `textbase` (and .text at address 0), so
+                the file is loaded with `add-symbol-file FILE ADDR` and one file works for any
+                ADDR, e.g. across KASLR slides. See docs/add-symbol-file.md.
+            sort_symbols: Sort the symbols by address, with the local ones first as ELF wants
+                (see `SymbolStore.laid_out`). Only the written file is sorted, not `store`.
+            infer_sizes: Give symbols without a size one reaching up to the next symbol's
+                address, see `ELFBuilder.inferred_sizes`.
+            workers: Number of processes to pack big symbol tables with.
+            stats: Record phase times and counters of loading, building and writing in it.
 
         """
         # zig_target_arch: The target architecture for the ELF file. Run `zig targets | less` and
@@ -39,7 +94,126 @@ class ELFFile:
         self.textbase: int = textbase
         self.zig_target_arch: str = zig_target_arch
         self.ptrsize: int = ptrbits
-        self.symbols: list[Symbol] = []
+        self.merge_strings: bool = merge_strings
+        self.relocatable: bool = relocatable
+        self.sort_symbols: bool = sort_symbols
+        self.infer_sizes: bool = infer_sizes
+        self.workers: int = workers
+        self.stats: BuildStats | None = stats
+        self.store = SymbolStore()
+        # Named address ranges with their own section, see `add_section`.
+        self.ranges: dict[str, tuple[int, int]] = {}
+        # A copy of the symbols as of the last write, see `write_delta`.
+        self.emitted: SymbolStore | None = None
+
+    @classmethod
+    def from_kallsyms(
+        cls,
+        source: loaders.Source,
+        textbase: int,
+        *,
+        modules: bool = False,
+        stats: BuildStats | None = None,
+    ) -> ELFFile:
+        """
+        Create an ELF file with all the symbols from a `/proc/kallsyms` style listing.
+
+        Arguments:
+            source: A path, an open file, or the listing itself as bytes.
+            textbase: See `__init__`.
+            modules: Give every module its own section (named like "[ext4]"), spanning its
+                symbols. Modules whose symbols interleave with other modules get a section
+                per run (see `loaders.module_ranges`), like "[ext4].1". See `add_section`.
+            stats: See `__init__`.
+
+        """
+        elf = cls(textbase, stats=stats)
+        with phase(stats, "ingest"):
+            if not modules:
+                loaders.load_kallsyms(elf.store, source)
+                return elf
+
+            stores = loaders.load_kallsyms_modules(source)
+            for module, ranges in loaders.module_ranges(stores).items():
+                for i, (start, end) in enumerate(ranges):
+                    elf.add_section(f"[{module}].{i}" if i else f"[{module}]", start, end)
+            for store in stores.values():
+                elf.store.extend_from(store)
+        return elf
+
+    @classmethod
+    def from_nm(
+        cls,
+        source: loaders.Source,
+        textbase: int,
+        *,
+        stats: BuildStats | None = None,
+    ) -> ELFFile:
+        """
+        Create an ELF file with all the defined symbols from `nm` (or `nm -S`) output.
+
+        A `System.map` is `nm` output as well, so this loads those too.
+
+        Arguments:
+            source: A path, an open file, or the output itself as bytes.
+            textbase: See `__init__`.
+            stats: See `__init__`.
+
+        """
+        elf = cls(textbase, stats=stats)
+        with phase(stats, "ingest"):
+            loaders.load_nm(elf.store, source)
+        return elf
+
+    @classmethod
+    def from_elf(
+        cls,
+        source: str | os.PathLike[str] | bytes | bytearray,
+        textbase: int | None = None,
+        *,
+        stats: BuildStats | None = None,
+    ) -> ELFFile:
+        """
+        Create an ELF file with the symbols of an existing one, e.g. `vmlinux` or an earlier output.
+
+        Arguments:
+            source: A path, or the file contents.
+            textbase: See `__init__`. Defaults to the address of the file's .text section.
+            stats: See `__init__`.
+
+        """
+        elf = cls(0, stats=stats)
+        with phase(stats, "ingest"):
+            text = loaders.load_elf(elf.store, source)
+        elf.textbase = textbase if textbase is not None else text or 0
+        return elf
+
+    @classmethod
+    def update_from(
+        cls,
+        existing_path: str | os.PathLike[str],
+        changes: update.SymbolChanges,
+        path: str | os.PathLike[str] | None = None,
+    ) -> ELFFile:
+        """
+        Apply `changes` to a symbol file written earlier, and write the result to `path`.
+
+        `path` defaults to `existing_path`, which is then replaced atomically. That is only allowed
+        for files written by this library, other ELF files (see `from_elf`) need a `path` or
+        raise a `ValueError`. Only the replaced and new symbols are packed, the rest of .symtab
+        and all of .strtab are copied over (new names are appended). Addresses are as stored in
+        the file, so relative to `textbase` for relocatable files. Returns the updated file, e.g.
+        for `write_delta` afterwards.
+
+        If the file had its local symbols first and the changes add locals after the others, it
+        is rebuilt with `sort_symbols` instead, to keep them first.
+        """
+        return update.update_file(existing_path, changes, path)
+
+    @property
+    def symbols(self) -> SymbolView:
+        """Read-only view of the added symbols, creating a `Symbol` for each accessed entry."""
+        return SymbolView(self.store)
 
     # I'm not sure whether size=0 or size=ptrsize or whatever makes a difference as a default.
     # I don't observer a difference.
@@ -52,20 +226,258 @@ class ELFFile:
         bind: int = DEFAULT_BIND,
     ) -> None:
         """If you don't know whether the symbols is a function or global variable use this."""
-        self.symbols.append(Symbol.generic(name, addr, size, bind))
+        # LIEF emits this type, so I trust.
+        self.store.append(name, addr, size, bind, datatypes.Constants.STT_COMMON)
 
     def add_function(self, name: str, addr: int, size: int = 0, bind: int = DEFAULT_BIND) -> None:
         """Use this if you know the symbol is a function."""
-        self.symbols.append(Symbol.function(name, addr, size, bind))
+        self.store.append(name, addr, size, bind, datatypes.Constants.STT_FUNC)
 
     def add_object(self, name: str, addr: int, size: int = 0, bind: int = DEFAULT_BIND) -> None:
         """Use this if you know the symbols is a global or local variable."""
-        self.symbols.append(Symbol.object(name, addr, size, bind))
+        self.store.append(name, addr, size, bind, datatypes.Constants.STT_OBJECT)
+
+    def add_symbols_bulk(
+        self,
+        names: Iterable[str] | Iterable[bytes],
+        addrs: Column,
+        sizes: Column | None = None,
+        binds: Column | None = None,
+        types: Column | None = None,
+    ) -> None:
+        """
+        Add many symbols at once from parallel columns.
+
+        The columns can be sequences, `array`s or buffer-protocol objects such as NumPy arrays,
+        and are stored column-wise without creating a `Symbol` per entry. `sizes` defaults to 0,
+        `binds` to `DEFAULT_BIND` and `types` to the type `add_generic_symbol` uses.
+        """
+        with phase(self.stats, "ingest"):
+            self.store.extend(
+                names,
+                addrs,
+                0 if sizes is None else sizes,
+                DEFAULT_BIND if binds is None else binds,
+                datatypes.Constants.STT_COMMON if types is None else types,
+            )
+
+    def add_section(self, name: str, start: int, end: int) -> None:
+        """
+        Give the address range [start, end) its own section, e.g. "[ext4]" for a kernel module.
+
+        Symbols inside the range are placed in that section instead of .text, so a kernel and
+        all its modules can be loaded as a single objfile. Ranges may not overlap (a ValueError
+        is raised right away), and (like symbols) are relative to `textbase` in relocatable
+        files. Adding a section again replaces its range.
+        """
+        if not start < end:
+            raise ValueError(f"Section {name} has an empty range ({start:#x} to {end:#x}).")
+        for other, (other_start, other_end) in self.ranges.items():
+            if other != name and start < other_end and other_start < end:
+                raise ValueError(f"Section {name} ({start:#x} to {end:#x}) overlaps {other}.")
+        self.ranges[name] = (start, end)
+
+    def rebase(self, delta: int) -> None:
+        """Move `textbase`, all symbols and all sections by `delta`, e.g. to a new KASLR slide."""
+        self.textbase = (self.textbase + delta) & U64_MASK
+        self.store.rebase(delta)
+        self.ranges = {
+            name: ((start + delta) & U64_MASK, (end + delta) & U64_MASK)
+            for name, (start, end) in self.ranges.items()
+        }
+
+    def builder(self, *, spare_symbols: int = 0, spare_strtab: int = 0) -> ELFBuilder:
+        """Return an `ELFBuilder` with all the sections of this file added."""
+        writer = ELFBuilder(
+            zig_target_arch_to_elf(self.zig_target_arch),
+            self.ptrsize,
+            workers=self.workers,
+            stats=self.stats,
+        )
+
+        # GDB places a symbol at `ADDR + (st_value - sh_addr)`, where ADDR is the address passed
+        # to add-symbol-file (or sh_addr if there is none).
+        base = self.textbase if self.relocatable else 0
+        writer.add_text_section(self.textbase - base)
+        for name, (start, end) in self.ranges.items():
+            mask = writer.addr_mask
+            writer.add_range_section(name, (start - base) & mask, (end - base) & mask)
+        store = self.store
+        if self.sort_symbols:
+            with phase(self.stats, "symtab"):
+                store = store.laid_out()
+        writer.add_symbols(
+            store,
+            merge_strings=self.merge_strings,
+            spare_symbols=spare_symbols,
+            spare_strtab=spare_strtab,
+            base=base,
+            infer_sizes=self.infer_sizes,
+        )
+
+        return writer
+
+    def build(self) -> bytearray:
+        """Return the contents of the ELF file, and remember its symbols for `write_delta`."""
+        image = self.builder().build()
+        self.emitted = self.store.copy()
+        return image
 
     def write(self, path: str) -> None:
-        writer = ELFBuilder(zig_target_arch_to_elf(self.zig_target_arch), self.ptrsize)
+        image = self.build()
+        # One write for the whole file.
+        with phase(self.stats, "io"):
+            Path(path).write_bytes(image)
+        if self.stats is not None:
+            self.stats.syscalls += 3  # open, write, close
+
+    def write_future(self, path: str, executor: Executor | None = None) -> Future[str]:
+        """
+        Write the ELF file in the background, and return a Future that resolves to `path`.
+
+        The symbols are snapshotted first, so the `ELFFile` can be modified right away. Use
+        `Future.add_done_callback` to learn when the file is ready. The callback runs on the
+        worker thread, and GDB's Python API may only be used from GDB's main thread, so hand
+        `add-symbol-file` over with `gdb.post_event`:
+
+            future.add_done_callback(lambda f: gdb.post_event(
+                lambda: gdb.execute(f"add-symbol-file {f.result()}")))
+
+        By default the file is built in a shared worker thread. The packing still holds the GIL
+        for parts of the build, so to keep the calling thread fully responsive pass a
+        `ProcessPoolExecutor` (then `stats` aren't recorded, as the build runs in another process).
+        """
+        snapshot = copy.copy(self)
+        snapshot.store = self.store.copy()
+        snapshot.ranges = dict(self.ranges)
+        if isinstance(executor, ProcessPoolExecutor):
+            snapshot.stats = None
+
+        future = (executor or _default_executor()).submit(_write, snapshot, path)
+
+        def written(future: Future[str]) -> None:
+            if not future.cancelled() and future.exception() is None:
+                self.emitted = snapshot.store
+
+        future.add_done_callback(written)
+        return future
+
+    async def write_async(self, path: str, executor: Executor | None = None) -> str:
+        """Like `write_future`, but awaitable from asyncio code."""
+        return await asyncio.wrap_future(self.write_future(path, executor))
+
+    def write_cached(self, cache: SymbolCache | None = None) -> str:
+        """
+        Return the path of a cached copy of the ELF file, writing it only on a cache miss.
+
+        `cache` defaults to a `SymbolCache` in the user's cache directory.
+        """
+        cache = cache if cache is not None else SymbolCache()
+        path = cache.get(self)
+        if path is None:
+            return cache.put(self)
+        self.emitted = self.store.copy()
+        return path
 
-        writer.add_text_section(self.textbase)
-        writer.add_symbols(self.symbols)
+    def write_delta(self, path: str) -> delta.SymbolDelta | None:
+        """
+        Write a supplementary ELF file with only the symbols added or changed since the last write.
+
+        Loading it with `add-symbol-file` on top of the previous files gives the current symbols,
+        except for the removed ones (which are returned, so they can be dropped some other way).
+        Returns None if nothing changed since the last write, in which case no file is written.
+        The first call, without an earlier write, writes all symbols.
+        """
+        previous = self.emitted if self.emitted is not None else SymbolStore()
+        added, removed = delta.diff(previous, self.store)
+        if not added and not removed:
+            return None
+
+        written = None
+        if added:
+            supplement = ELFFile(
+                self.textbase,
+                merge_strings=self.merge_strings,
+                relocatable=self.relocatable,
+                sort_symbols=self.sort_symbols,
+                infer_sizes=self.infer_sizes,
+            )
+            supplement.store = added
+            supplement.ranges = self.ranges
+            supplement.write(path)
+            written = path
+
+        self.emitted = self.store.copy()
+        return delta.SymbolDelta(path=written, written=len(added), removed=removed)
+
+    def write_incremental(
+        self,
+        path: str,
+        spare_symbols: int = 4096,
+        spare_strtab: int | None = None,
+    ) -> IncrementalWriter:
+        """
+        Write the ELF file, and keep it around for cheap in-place symbol updates.
+
+        Room for `spare_symbols` more symbols and `spare_strtab` more name bytes (by default 32
+        per spare symbol) is reserved in the file. See `IncrementalWriter` for the updates.
+        """
+        if spare_strtab is None:
+            spare_strtab = spare_symbols * 32
+        return IncrementalWriter(self, path, spare_symbols, spare_strtab)
+
+    def write_shards(
+        self,
+        directory: str | os.PathLike[str],
+        count: int = 8,
+    ) -> shards.ShardManifest:
+        """
+        Write the symbols as `count` files split by address, see `shards.split_by_address`.
+
+        The shards keep the address bounds of the last call until one gets too big (see
+        `shards.address_bounds`). Only the shards whose symbols changed since then are rewritten,
+        the returned manifest lists them.
+        """
+        previous = shards.ShardManifest.load(directory)
+        bounds = shards.address_bounds(sorted(self.store.value), count, previous.bounds)
+        return shards.write_shards(shards.split_by_address(self, count, bounds), directory, bounds)
+
+    def to_bytes(self) -> bytes:
+        """Return the contents of the ELF file without touching the filesystem."""
+        return bytes(self.build())
+
+    def write_to(self, dest: int | IO[bytes]) -> None:
+        """Write the ELF file to an open binary file object or file descriptor."""
+        image = self.build()
+        with phase(self.stats, "io"):
+            if not isinstance(dest, int):
+                dest.write(image)
+                writes = 1
+            else:
+                view = memoryview(image)
+                writes = 0
+                while view:
+                    view = view[os.write(dest, view) :]
+                    writes += 1
+        if self.stats is not None:
+            self.stats.syscalls += writes
+
+    def write_memfd(self, name: str = "symbols.elf") -> tuple[int, str]:
+        """
+        Write the ELF file into an anonymous in-memory file (Linux only).
+
+        Returns the file descriptor and a `/proc/self/fd/N` path to it, which can be passed to
+        `add-symbol-file` as usual. Close the descriptor once the debugger has opened the file.
+        """
+        if not hasattr(os, "memfd_create"):
+            raise NotImplementedError("memfd_create is only available on Linux.")
 
-        writer.write(path)
+        fd = os.memfd_create(name, os.MFD_CLOEXEC)
+        if self.stats is not None:
+            self.stats.syscalls += 1
+        try:
+            self.write_to(fd)
+        except:
+            os.close(fd)
+            raise
+        return fd, f"/proc/self/fd/{fd}"
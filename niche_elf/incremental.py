@@ -0,0 +1,231 @@
+"""Keeps a written symbol file up to date by patching it in place."""
+
+from __future__ import annotations
+
+import ctypes
+import os
+from typing import TYPE_CHECKING
+
+from . import datatypes
+from .builder import TEXT_INDEX
+from .util import write_atomic
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from .builder import ELFBuilder
+    from .elf import ELFFile
+
+
+class IncrementalWriter:
+    """
+    A written ELF file which applies symbol changes by rewriting only the affected bytes.
+
+    The file is laid out with spare room after `.symtab` and `.strtab`. Adding a symbol writes
+    one entry and its name into that room and bumps the two `sh_size`s, the other updates patch
+    a handful of entries. Renamed symbols get their new name appended to `.strtab`, and removed
+    symbols are replaced by the last entry. Once the spare room runs out the whole file is
+    rebuilt (with fresh spare room), transparently.
+
+    If the local symbols come first (see `SymbolStore.local_count`), they are kept first: an
+    added local swaps places with the first other symbol, and `sh_info` follows along. With
+    `ELFFile.sort_symbols` and `ELFFile.infer_sizes` the symbols are only sorted, and missing
+    sizes inferred, on rebuilds.
+
+    The `ELFFile` the writer was created from is kept in sync, so writing it out normally gives
+    the same symbols.
+
+    Use `ELFFile.write_incremental` to create one.
+    """
+
+    def __init__(self, elf: ELFFile, path: str, spare_symbols: int, spare_strtab: int) -> None:
+        if elf.merge_strings:
+            raise ValueError("Incremental updates don't support merge_strings.")
+
+        self.elf = elf
+        self.path = path
+        self.spare_symbols = spare_symbols
+        self.spare_strtab = spare_strtab
+        # Subtracted from symbol values, see `ELFFile.builder`.
+        self.base = elf.textbase if elf.relocatable else 0
+        # How many times the file had to be regenerated, including the initial write.
+        self.rebuilds = 0
+        self.fd = -1
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Regenerate the whole file, restoring the configured spare room."""
+        store = self.elf.store
+        # Drop names orphaned by renames and removals.
+        store.compact()
+        if self.elf.sort_symbols:
+            # Slots have to match the entries, so sort the symbols themselves. The builder then
+            # finds them in order already.
+            self.elf.store = store = store.laid_out()
+
+        builder = self.elf.builder(
+            spare_symbols=self.spare_symbols,
+            spare_strtab=self.spare_strtab,
+        )
+        image = builder.build()
+
+        # A debugger may still be reading the old file.
+        write_atomic(self.path, image)
+
+        if self.fd != -1:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDWR)
+        self.rebuilds += 1
+
+        self.builder: ELFBuilder = builder
+        self.shoff: int = builder.ElfEhdr.from_buffer_copy(image).e_shoff
+        self.entsize: int = ctypes.sizeof(builder.ElfSym)
+        self.symtab_index: int = builder.symtab_index
+        self.strtab_index: int = builder.symtab_index + 1
+        symtab_sec = builder.sections[self.symtab_index]
+        strtab_sec = builder.sections[self.strtab_index]
+        # Minus the NULL entry.
+        self.symbol_capacity: int = (len(symtab_sec.data) + symtab_sec.reserved) // self.entsize - 1
+        self.strtab_capacity: int = len(strtab_sec.data) + strtab_sec.reserved
+
+        self.index: dict[bytes, list[int]] = store.name_index()
+        self.local_count: int | None = store.local_count()
+
+    def close(self) -> None:
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self) -> IncrementalWriter:  # noqa: PYI034
+        """Return the writer itself, it is closed on exit."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the file."""
+        self.close()
+
+    def add(
+        self,
+        name: str,
+        addr: int,
+        size: int = 0,
+        bind: int = datatypes.Constants.STB_GLOBAL,
+        typ: int = datatypes.Constants.STT_COMMON,
+    ) -> None:
+        """Add a symbol. Defaults match `ELFFile.add_generic_symbol`."""
+        store = self.elf.store
+        strtab_start = len(store.strtab.data)
+        store.append(name, addr, size, bind, typ)
+        slot = len(store) - 1
+        self.index.setdefault(name.encode(), []).append(slot)
+        slots = [slot]
+        if self.local_count is not None and bind == datatypes.Constants.STB_LOCAL:
+            if slot != self.local_count:
+                store.swap(slot, self.local_count, self.index)
+                slots.append(self.local_count)
+            self.local_count += 1
+        self.flush(slots, strtab_start)
+
+    def rename(self, name: str, new_name: str) -> None:
+        """Rename all symbols called `name`."""
+        store = self.elf.store
+        slots = self.index.pop(name.encode())
+        self.index.setdefault(new_name.encode(), []).extend(slots)
+
+        strtab_start = len(store.strtab.data)
+        for slot in slots:
+            store.name[slot] = store.strtab.add(new_name)
+        self.flush(slots, strtab_start)
+
+    def move(self, name: str, addr: int, size: int | None = None) -> None:
+        """Change the address (and optionally size) of all symbols called `name`."""
+        store = self.elf.store
+        slots = self.index[name.encode()]
+        for slot in slots:
+            store.value[slot] = addr
+            if size is not None:
+                store.size[slot] = size
+        self.flush(slots, len(store.strtab.data))
+
+    def remove(self, name: str) -> None:
+        """Remove all symbols called `name`."""
+        store = self.elf.store
+        slots = self.index.pop(name.encode())
+        local_count = self.local_count
+        moved = store.remove_slots(slots, self.index, local_count or 0)
+        if local_count is not None:
+            self.local_count = local_count - sum(slot < local_count for slot in slots)
+        else:
+            # Removing the stray locals (or moving the last entry) may have put them first.
+            self.local_count = store.local_count()
+
+        # Wipe the entries that fell off the end, they are outside of sh_size anyway.
+        os.pwrite(self.fd, bytes(len(slots) * self.entsize), self.entry_offset(len(store)))
+        self.flush(moved, len(store.strtab.data))
+
+    def entry_offset(self, slot: int) -> int:
+        # The NULL entry comes first.
+        symtab_offset: int = self.builder.sections[self.symtab_index].header.sh_offset
+        return symtab_offset + (slot + 1) * self.entsize
+
+    def flush(self, slots: list[int], strtab_start: int) -> None:
+        """Write out the given symbol entries and the names appended from `strtab_start` on."""
+        store = self.elf.store
+        if len(store) > self.symbol_capacity or len(store.strtab.data) > self.strtab_capacity:
+            self.rebuild()
+            return
+
+        sections = self.builder.sections
+        strtab_offset = sections[self.strtab_index].header.sh_offset
+        os.pwrite(self.fd, store.strtab.data[strtab_start:], strtab_offset + strtab_start)
+
+        mask = self.builder.addr_mask
+        values = [(store.value[slot] - self.base) & mask for slot in slots]
+        st_shndx = self.builder.section_indices(values)
+        for slot, value, shndx in zip(slots, values, st_shndx, strict=True):
+            entry = self.builder.ElfSym(
+                st_name=store.name[slot],
+                st_value=value,
+                st_size=store.size[slot],
+                bind=store.bind[slot],
+                typ=store.typ[slot],
+                st_other=0,
+                st_shndx=shndx,
+            )
+            os.pwrite(self.fd, bytes(entry), self.entry_offset(slot))
+
+        self.set_section_size(self.symtab_index, (len(store) + 1) * self.entsize)
+        self.set_section_size(self.strtab_index, len(store.strtab.data))
+        symtab = sections[self.symtab_index].header
+        if self.local_count is not None and symtab.sh_info != self.local_count + 1:
+            symtab.sh_info = self.local_count + 1
+            self.write_header(self.symtab_index)
+
+        # Grow .text if a symbol in it now ends past it, see ELFBuilder.add_symbols.
+        text = sections[TEXT_INDEX].header
+        end = max(
+            (
+                value + store.size[slot]
+                for slot, value, shndx in zip(slots, values, st_shndx, strict=True)
+                if shndx == TEXT_INDEX
+            ),
+            default=0,
+        )
+        if end + 1 - text.sh_addr > text.sh_size:
+            self.set_section_size(TEXT_INDEX, end + 1 - text.sh_addr)
+
+    def set_section_size(self, index: int, size: int) -> None:
+        header = self.builder.sections[index].header
+        if header.sh_size == size:
+            return
+        header.sh_size = size
+        self.write_header(index)
+
+    def write_header(self, index: int) -> None:
+        header = self.builder.sections[index].header
+        os.pwrite(self.fd, bytes(header), self.shoff + index * ctypes.sizeof(header))
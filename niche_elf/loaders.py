@@ -0,0 +1,329 @@
+"""Bulk loaders for symbol listings (kallsyms, System.map, nm output) and ELF symbol tables."""
+
+from __future__ import annotations
+
+import ctypes
+import io
+import mmap
+import operator
+import os
+import re
+import sys
+from array import array
+from itertools import compress, groupby, repeat
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Literal, TypeAlias
+
+from . import datatypes
+from .datatypes import Constants
+from .structures import StrTab, SymbolStore
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping
+
+# A path, the contents themselves, or an open file (binary or text).
+Source: TypeAlias = "str | os.PathLike[str] | bytes | bytearray | memoryview | IO[bytes] | IO[str]"
+
+# Big enough that the per-chunk overhead vanishes, small enough that the token lists of one chunk
+# stay in the tens of megabytes.
+CHUNK_SIZE: int = 1 << 24
+
+# I trust bata: bata24/gef.py:create_symboled_elf()
+# Lowercase type letters are local symbols, and only text and weak symbols are functions.
+_BIND_TABLE = bytes(
+    Constants.STB_LOCAL if ord("a") <= c <= ord("z") else Constants.STB_GLOBAL for c in range(256)
+)
+_TYPE_TABLE = bytes(Constants.STT_FUNC if c in b"TtW" else Constants.STT_OBJECT for c in range(256))
+
+# The optional `\t[module]` column of /proc/kallsyms.
+_KALLSYMS_MODULE = re.compile(rb"\t\[[^\]\n]*\]")
+# A whole line of a module symbol, split into the symbol part and the module name.
+_KALLSYMS_MODULE_LINE = re.compile(rb"^([^\n]*)\t\[([^\]\n]*)\][^\n]*\n?", re.MULTILINE)
+# Tolerant line format, used when a chunk doesn't split cleanly into three columns.
+_KALLSYMS_LINE = re.compile(rb"^[ \t]*([0-9a-fA-F]+)[ \t]+(\S)[ \t]+(\S+)", re.MULTILINE)
+# `nm` and `nm -S` lines. Undefined symbols are printed without an address and don't match.
+_NM_LINE = re.compile(
+    rb"^[ \t]*([0-9a-fA-F]+)[ \t]+(?:([0-9a-fA-F]+)[ \t]+)?(\S)[ \t]+(\S+)",
+    re.MULTILINE,
+)
+
+
+# Split an `st_info` byte into its binding and type.
+_ST_BIND_TABLE = bytes(info >> 4 for info in range(256))
+_ST_TYPE_TABLE = bytes(info & 0xF for info in range(256))
+# 0 for the symbol types that don't name anything at an address, by `st_info`.
+_KEPT_TYPE_TABLE = bytes(
+    info & 0xF not in {Constants.STT_SECTION, Constants.STT_FILE} for info in range(256)
+)
+_SHN_UNDEF = 0
+_SHN_XINDEX = 0xFFFF
+# By size, for reading symbol table fields.
+_FIELD_TYPECODES: dict[int, Literal["B", "H", "I", "Q"]] = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+# Hex digits of 32-bit and 64-bit addresses.
+_HEX_WIDTH_TYPECODES: dict[int, Literal["I", "Q"]] = {8: "I", 16: "Q"}
+
+
+def _read_chunks(source: Source) -> Iterator[bytes]:
+    """Yield the contents of `source` in chunks that end on a line boundary."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield from _split_chunks(io.BytesIO(source))
+    elif isinstance(source, (str, os.PathLike)):
+        with Path(source).open("rb") as f:
+            yield from _split_chunks(f)
+    else:
+        yield from _split_chunks(source)
+
+
+def _split_chunks(f: IO[bytes] | IO[str]) -> Iterator[bytes]:
+    rest = b""
+    while block := f.read(CHUNK_SIZE):
+        data = rest + (block.encode() if isinstance(block, str) else block)
+        cut = data.rfind(b"\n") + 1
+        yield data[:cut]
+        rest = data[cut:]
+    if rest:
+        yield rest
+
+
+def _parse_hex(tokens: list[bytes]) -> array[int]:
+    result = array("Q")
+    width = len(tokens[0]) if tokens else 0
+    joined = b"".join(tokens)
+    # Fast path for fixed-width addresses (what the kernel prints): decode them all at once as
+    # big endian integers. With the total length matching, no token being longer means they
+    # all have the same width.
+    typecode = _HEX_WIDTH_TYPECODES.get(width)
+    if typecode and len(joined) == width * len(tokens) and max(map(len, tokens)) == width:
+        try:
+            raw = bytes.fromhex(joined.decode())
+        except ValueError:
+            pass
+        else:
+            fixed = array(typecode)
+            fixed.frombytes(raw)
+            if sys.byteorder == "little":
+                fixed.byteswap()
+            return fixed if fixed.typecode == "Q" else array("Q", fixed)
+
+    result.extend(map(int, tokens, repeat(16)))
+    return result
+
+
+def _add_columns(
+    store: SymbolStore,
+    addrs: list[bytes],
+    sizes: list[bytes] | None,
+    letters: bytes,
+    names: list[bytes],
+) -> None:
+    if b"U" in letters:
+        # Undefined symbols don't have an address we could point at.
+        keep = list(map(ord("U").__ne__, letters))
+        addrs = list(compress(addrs, keep))
+        sizes = list(compress(sizes, keep)) if sizes is not None else None
+        letters = bytes(compress(letters, keep))
+        names = list(compress(names, keep))
+
+    store.extend(
+        names,
+        _parse_hex(addrs),
+        0 if sizes is None else _parse_hex(sizes),
+        letters.translate(_BIND_TABLE),
+        letters.translate(_TYPE_TABLE),
+    )
+
+
+def load_kallsyms(store: SymbolStore, source: Source) -> None:
+    """
+    Add all symbols from a `/proc/kallsyms` style listing to `store`.
+
+    Lines have the `addr type name [module]` format. The module column is ignored, module
+    symbols are added like all others.
+    """
+    for chunk in _read_chunks(source):
+        _load_kallsyms_chunk(store, _KALLSYMS_MODULE.sub(b"", chunk))
+
+
+def load_kallsyms_modules(source: Source) -> dict[str, SymbolStore]:
+    """
+    Load a `/proc/kallsyms` style listing into one store per module.
+
+    Symbols without a module column (the kernel itself) end up under the "" key.
+    """
+    stores: dict[str, SymbolStore] = {}
+    for chunk in _read_chunks(source):
+        lines: dict[bytes, list[bytes]] = {}
+        for symbol, module in _KALLSYMS_MODULE_LINE.findall(chunk):
+            lines.setdefault(module, []).append(symbol)
+        core = _KALLSYMS_MODULE_LINE.sub(b"", chunk) if lines else chunk
+        _load_kallsyms_chunk(stores.setdefault("", SymbolStore()), core)
+        for module, symbols in lines.items():
+            store = stores.setdefault(module.decode(), SymbolStore())
+            _load_kallsyms_chunk(store, b"\n".join(symbols))
+    return stores
+
+
+def module_ranges(stores: Mapping[str, SymbolStore]) -> dict[str, list[tuple[int, int]]]:
+    """
+    Return the [start, end) address ranges of the modules from `load_kallsyms_modules`.
+
+    Since Linux 6.4 a module's code and data are allocated separately, so the symbols of
+    different modules can interleave. Every run of a module's symbols that are next to each
+    other by address gets a range, so the ranges never overlap. An address shared with the
+    next run goes to that one. The ranges of every module are in address order.
+    """
+    pairs = sorted(
+        (addr, module) for module, store in stores.items() if module for addr in store.value
+    )
+    runs = []
+    for module, run in groupby(pairs, key=operator.itemgetter(1)):
+        addrs = [addr for addr, _ in run]
+        runs.append((module, addrs[0], addrs[-1] + 1))
+
+    ranges: dict[str, list[tuple[int, int]]] = {}
+    for i, (module, start, end) in enumerate(runs):
+        if i + 1 < len(runs):
+            end = min(end, runs[i + 1][1])  # noqa: PLW2901
+        if start < end:
+            ranges.setdefault(module, []).append((start, end))
+    return ranges
+
+
+def _load_kallsyms_chunk(store: SymbolStore, chunk: bytes) -> None:
+    tokens = chunk.split()
+    addrs, names = tokens[0::3], tokens[2::3]
+    letters = b"".join(tokens[1::3])
+    if len(tokens) % 3 or len(letters) != len(names):
+        matches = _KALLSYMS_LINE.findall(chunk)
+        addrs = [m[0] for m in matches]
+        letters = b"".join([m[1] for m in matches])
+        names = [m[2] for m in matches]
+    _add_columns(store, addrs, None, letters, names)
+
+
+def load_nm(store: SymbolStore, source: Source) -> None:
+    """
+    Add all defined symbols from `nm` output (e.g. a `System.map`) to `store`.
+
+    Lines have the `addr [size] type name` format, where `size` is only printed by `nm -S`.
+    Undefined (`U`) symbols, which don't have an address, are skipped.
+    """
+    for chunk in _read_chunks(source):
+        tokens = chunk.split()
+        addrs, names = tokens[0::3], tokens[2::3]
+        letters = b"".join(tokens[1::3])
+        sizes = None
+        # A System.map or plain `nm` of a linked binary only has three column lines, anything else
+        # (sizes, undefined symbols, archive member headers) is handled line by line.
+        if len(tokens) % 3 or len(letters) != len(names):
+            matches = _NM_LINE.findall(chunk)
+            addrs = [m[0] for m in matches]
+            sizes = [m[1] or b"0" for m in matches]
+            letters = b"".join([m[2] for m in matches])
+            names = [m[3] for m in matches]
+        _add_columns(store, addrs, sizes, letters, names)
+
+
+def load_elf(store: SymbolStore, source: str | os.PathLike[str] | bytes | bytearray) -> int | None:
+    """
+    Add all defined symbols of an ELF file's `.symtab` (or `.dynsym`, if stripped) to `store`.
+
+    The file is mmapped, and every field is read for all entries at once with a strided view
+    over the table, using the `datatypes` layouts. Names aren't decoded: `.strtab` is taken
+    over as a whole and `st_name` used as the offsets into it. Undefined, section and file
+    symbols are skipped. Values are taken as is, so they are section offsets in relocatable
+    objects (e.g. kernel modules).
+
+    Returns the address of the `.text` section, or None if there is none.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return _load_elf_image(store, source)
+    with Path(source).open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+        return _load_elf_image(store, image)
+
+
+def elf_headers(
+    image: bytes | bytearray | mmap.mmap,
+) -> tuple[ctypes.Structure, list[tuple[bytes, ctypes.Structure]]]:
+    """Return the ELF header of a (little endian) ELF file, and every section's name and header."""
+    if image[:4] != b"\x7fELF" or image[4] not in {1, 2}:
+        raise ValueError("Not an ELF file.")
+    # The ctypes layouts are native, and `ELFBuilder` only writes little endian files anyway.
+    if image[5] != 1:
+        raise ValueError("Only little endian ELF files are supported.")
+
+    ptrbits = image[4] * 32
+    ehdr = {32: datatypes.ElfEhdr32, 64: datatypes.ElfEhdr64}[ptrbits].from_buffer_copy(image)
+    if not ehdr.e_shoff:
+        return ehdr, []
+    shdr_type = {32: datatypes.ElfShdr32, 64: datatypes.ElfShdr64}[ptrbits]
+
+    # With too many sections for the ELF header, the counts are in the first section header.
+    first = shdr_type.from_buffer_copy(image, ehdr.e_shoff)
+    shnum = ehdr.e_shnum or first.sh_size
+    shstrndx = first.sh_link if ehdr.e_shstrndx == _SHN_XINDEX else ehdr.e_shstrndx
+    headers = (shdr_type * shnum).from_buffer_copy(image, ehdr.e_shoff)
+
+    shstrtab = section_contents(image, headers[shstrndx])
+    names = [shstrtab[h.sh_name : shstrtab.index(0, h.sh_name)] for h in headers]
+    return ehdr, list(zip(names, headers, strict=True))
+
+
+def section_contents(image: bytes | bytearray | mmap.mmap, header: ctypes.Structure) -> bytes:
+    return bytes(image[header.sh_offset : header.sh_offset + header.sh_size])
+
+
+def _load_elf_image(store: SymbolStore, image: bytes | bytearray | mmap.mmap) -> int | None:
+    _, sections = elf_headers(image)
+    entry = {1: datatypes.ElfSym32, 2: datatypes.ElfSym64}[image[4]]
+    headers = [header for _, header in sections]
+    text = next((header.sh_addr for name, header in sections if name == b".text"), None)
+
+    symtab = next((h for h in headers if h.sh_type == Constants.SHT_SYMTAB), None)
+    symtab = symtab or next((h for h in headers if h.sh_type == Constants.SHT_DYNSYM), None)
+    if symtab is None:
+        return text
+
+    entsize = ctypes.sizeof(entry)
+    data = section_contents(image, symtab)
+    count = len(data) // entsize
+    view = memoryview(data)[: count * entsize]
+
+    def field_bytes(name: str) -> bytes:
+        """Return the raw bytes of a field, for all entries."""
+        field = getattr(entry, name)
+        typecode = _FIELD_TYPECODES[field.size]
+        return view.cast(typecode)[field.offset // field.size :: entsize // field.size].tobytes()
+
+    def wide(name: str) -> array[int]:
+        raw = array(_FIELD_TYPECODES[getattr(entry, name).size])
+        raw.frombytes(field_bytes(name))
+        return raw if raw.typecode == "Q" else array("Q", raw)
+
+    st_name = array("I")
+    st_name.frombytes(field_bytes("st_name"))
+    st_shndx = array("H")
+    st_shndx.frombytes(field_bytes("st_shndx"))
+    info = field_bytes("st_info")
+    columns = [
+        st_name,
+        wide("st_value"),
+        wide("st_size"),
+        array("B", info.translate(_ST_BIND_TABLE)),
+        array("B", info.translate(_ST_TYPE_TABLE)),
+    ]
+
+    # Skip undefined symbols (including the NULL entry) and section and file symbols. Files we
+    # wrote ourselves only have the NULL entry to skip, which the counts find without a loop.
+    kept_types = info.translate(_KEPT_TYPE_TABLE)
+    if st_shndx.count(_SHN_UNDEF) == 1 and not st_shndx[0] and kept_types.count(0) == 0:
+        columns = [column[1:] for column in columns]
+    else:
+        kept = list(map(operator.and_, map(bool, st_shndx), kept_types))
+        columns = [array(column.typecode, compress(column, kept)) for column in columns]
+
+    strtab = StrTab(bytearray(section_contents(image, headers[symtab.sh_link])))
+    loaded = SymbolStore(strtab, *columns)
+    store.extend_from(loaded)
+    return text
@@ -0,0 +1,215 @@
+"""Keeps a symbol file up to date with bursts of symbol changes from any thread."""
+
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from typing import TYPE_CHECKING, cast
+
+from . import datatypes
+from .elf import DEFAULT_BIND, ELFFile
+from .util import write_atomic
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+    from types import TracebackType
+
+    from .structures import Column
+
+
+class SymbolSession:
+    """
+    A long-lived symbol set that republishes its ELF file shortly after it changes.
+
+    Changes can come from any thread. They are applied to the in-memory symbols right away,
+    but the file is only rebuilt once no change arrived for `debounce` seconds (or `max_delay`
+    seconds after the first unpublished change, for never-ending bursts). The rebuild runs in a
+    background thread and replaces the file with an atomic rename, so a debugger never sees a
+    half-written file. `on_publish` is called with the path after each one, from that thread:
+    GDB's Python API may only be used from GDB's main thread, so e.g. hand `add-symbol-file`
+    over with `gdb.post_event`.
+
+    The symbol store, with its string table, and the name index are kept across rebuilds,
+    only a copy of the columns is taken for each build.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        textbase: int,
+        *,
+        debounce: float = 0.2,
+        max_delay: float = 2.0,
+        on_publish: Callable[[str], None] | None = None,
+        relocatable: bool = False,
+    ) -> None:
+        self.path = path
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.on_publish = on_publish
+        self.elf = ELFFile(textbase, relocatable=relocatable)
+        self.index: dict[bytes, list[int]] = {}
+        # The last exception of a background rebuild, if any.
+        self.error: BaseException | None = None
+
+        self.condition = threading.Condition()
+        # Bumped on every change, `published` is the generation last written out.
+        self.generation = 0
+        self.published = 0
+        self.first_change = 0.0
+        self.deadline = 0.0
+        self.closed = False
+        # .strtab bytes no longer referenced by any symbol, see `snapshot`.
+        self.orphaned = 0
+
+        self.thread = threading.Thread(target=self.run, name="niche-elf-session", daemon=True)
+        self.thread.start()
+
+    def add(
+        self,
+        name: str,
+        addr: int,
+        size: int = 0,
+        bind: int = DEFAULT_BIND,
+        typ: int = datatypes.Constants.STT_COMMON,
+    ) -> None:
+        """Add a symbol. Defaults match `ELFFile.add_generic_symbol`."""
+        with self.condition:
+            store = self.elf.store
+            store.append(name, addr, size, bind, typ)
+            self.index.setdefault(name.encode(), []).append(len(store) - 1)
+            self.changed()
+
+    def extend(
+        self,
+        names: Iterable[str] | Iterable[bytes],
+        addrs: Column,
+        sizes: Column | None = None,
+        binds: Column | None = None,
+        types: Column | None = None,
+    ) -> None:
+        """Add many symbols at once, see `ELFFile.add_symbols_bulk`."""
+        names = cast("list[str] | list[bytes]", list(names))
+        with self.condition:
+            store = self.elf.store
+            start = len(store)
+            self.elf.add_symbols_bulk(names, addrs, sizes, binds, types)
+            for slot, name in enumerate(cast("list[str | bytes]", names), start):
+                key = name.encode() if isinstance(name, str) else name
+                self.index.setdefault(key, []).append(slot)
+            self.changed()
+
+    def rename(self, name: str, new_name: str) -> None:
+        """Rename all symbols called `name`."""
+        with self.condition:
+            store = self.elf.store
+            slots = self.index.pop(name.encode())
+            self.index.setdefault(new_name.encode(), []).extend(slots)
+            self.orphaned += (len(name.encode()) + 1) * len(slots)
+            offset = store.strtab.add(new_name)
+            for slot in slots:
+                store.name[slot] = offset
+            self.changed()
+
+    def move(self, name: str, addr: int, size: int | None = None) -> None:
+        """Change the address (and optionally size) of all symbols called `name`."""
+        with self.condition:
+            store = self.elf.store
+            for slot in self.index[name.encode()]:
+                store.value[slot] = addr
+                if size is not None:
+                    store.size[slot] = size
+            self.changed()
+
+    def remove(self, name: str) -> None:
+        """Remove all symbols called `name`."""
+        with self.condition:
+            slots = self.index.pop(name.encode())
+            self.orphaned += (len(name.encode()) + 1) * len(slots)
+            self.elf.store.remove_slots(slots, self.index)
+            self.changed()
+
+    def changed(self) -> None:
+        """Schedule a rebuild. Must be called with `condition` held."""
+        now = time.monotonic()
+        if self.published == self.generation:
+            self.first_change = now
+        self.generation += 1
+        self.deadline = min(now + self.debounce, self.first_change + self.max_delay)
+        self.condition.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Publish pending changes now, and wait until they are written.
+
+        Returns False if that didn't happen within `timeout` seconds.
+        """
+        with self.condition:
+            target = self.generation
+            self.deadline = time.monotonic()
+            self.condition.notify_all()
+            return self.condition.wait_for(
+                lambda: self.published >= target or not self.thread.is_alive(),
+                timeout,
+            )
+
+    def close(self) -> None:
+        """Publish pending changes and stop the background thread."""
+        with self.condition:
+            self.closed = True
+            self.deadline = time.monotonic()
+            self.condition.notify_all()
+        self.thread.join()
+
+    def __enter__(self) -> SymbolSession:  # noqa: PYI034
+        """Return the session itself, it is closed on exit."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Publish pending changes and stop the background thread."""
+        self.close()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.published < self.generation or self.closed)
+                if self.published == self.generation:
+                    return
+                # Let the burst settle.
+                while (remaining := self.deadline - time.monotonic()) > 0:
+                    self.condition.wait(remaining)
+                generation = self.generation
+                snapshot = self.snapshot()
+
+            try:
+                write_atomic(self.path, snapshot.builder().build())
+                if self.on_publish is not None:
+                    self.on_publish(self.path)
+            except Exception as e:  # noqa: BLE001
+                # Keep the session alive, the next change retries.
+                self.error = e
+            else:
+                self.error = None
+
+            with self.condition:
+                self.published = generation
+                self.condition.notify_all()
+
+    def snapshot(self) -> ELFFile:
+        """Return a copy of the symbols to build from. Must be called with `condition` held."""
+        store = self.elf.store
+        # Renames and removals leave the old names behind, drop them once they make up half of
+        # the table. Slots don't change, so the index stays valid.
+        if self.orphaned * 2 > len(store.strtab.data):
+            store.compact()
+            self.orphaned = 0
+
+        snapshot = copy.copy(self.elf)
+        snapshot.store = store.copy()
+        return snapshot
@@ -0,0 +1,222 @@
+"""Splits a symbol set over several ELF files, so a change only reloads the affected ones."""
+
+from __future__ import annotations
+
+import bisect
+import copy
+import json
+from dataclasses import asdict, dataclass, field
+from itertools import pairwise
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from . import loaders
+from .cache import fingerprint
+from .structures import U64_MASK
+from .util import write_atomic
+
+if TYPE_CHECKING:
+    import os
+    from collections.abc import Iterable, Mapping, Sequence
+
+    from .elf import ELFFile
+
+MANIFEST_NAME = "manifest.json"
+# A shard may grow to this many times an even share of the symbols before `address_bounds`
+# splits them anew.
+RESPLIT_FACTOR = 2
+
+
+@dataclass
+class Shard:
+    # File name, relative to the shard directory.
+    file: str
+    # Address range of the shard, from the start of its .text to one past its last symbol.
+    start: int
+    end: int
+    symbols: int
+    # See `cache.fingerprint`.
+    digest: str
+
+
+@dataclass
+class ShardManifest:
+    """The shards in a directory, and what the last `write_shards` changed."""
+
+    directory: Path
+    shards: dict[str, Shard]
+    # Shards that were (re)written and have to be (re)loaded.
+    changed: list[str] = field(default_factory=list)
+    # Shards that no longer exist, their files were deleted.
+    removed: list[str] = field(default_factory=list)
+    # Where the shards after the first start, for shards split by address. See `address_bounds`.
+    bounds: list[int] = field(default_factory=list)
+
+    def path(self, name: str) -> Path:
+        return self.directory / self.shards[name].file
+
+    @classmethod
+    def load(cls, directory: str | os.PathLike[str]) -> ShardManifest:
+        """Read the manifest of a shard directory, which is empty if there is none."""
+        directory = Path(directory)
+        try:
+            data = json.loads((directory / MANIFEST_NAME).read_text())
+        except FileNotFoundError:
+            data = {}
+        shards = {name: Shard(**shard) for name, shard in data.get("shards", {}).items()}
+        return cls(directory, shards, bounds=data.get("bounds", []))
+
+    def save(self) -> None:
+        shards = {name: asdict(shard) for name, shard in self.shards.items()}
+        data = json.dumps({"shards": shards, "bounds": self.bounds}, indent=2, sort_keys=True)
+        write_atomic(self.directory / MANIFEST_NAME, (data + "\n").encode())
+
+
+def address_bounds(values: Sequence[int], count: int, previous: Sequence[int] = ()) -> list[int]:
+    """
+    Return the addresses where the shards after the first start, to split `values` in `count`.
+
+    `values` are the sorted symbol addresses. The shards get about the same number of symbols,
+    and symbols at the same address always end up in the same shard. `previous` bounds (see
+    `ShardManifest.bounds`) are kept until a shard holds more than `RESPLIT_FACTOR` times its
+    share, so adding or removing a symbol only changes the shard holding it.
+    """
+    if len(previous) == count - 1:
+        cuts = [0, *(bisect.bisect_left(values, bound) for bound in previous), len(values)]
+        limit = RESPLIT_FACTOR * len(values) / count
+        if all(end - begin <= limit for begin, end in pairwise(cuts)):
+            return list(previous)
+    if not values:
+        return []
+    return [values[len(values) * i // count] for i in range(1, count)]
+
+
+def split_by_address(
+    elf: ELFFile,
+    count: int,
+    bounds: Sequence[int] | None = None,
+) -> dict[str, ELFFile]:
+    """
+    Split `elf` into `count` shards covering consecutive address ranges.
+
+    The shards after the first start at `bounds`, by default an even split (see
+    `address_bounds`). Shard names sort in address order. Range sections (see
+    `ELFFile.add_section`) are clipped to the shard, and every shard's .text starts at its
+    lowest symbol outside of them. So the sections don't overlap, which would break GDB's
+    section lookup. The options of `elf` are kept, but relocatable shards are thus relative to
+    their own .text: each is loaded at its manifest `start` plus the slide.
+    """
+    store = elf.store
+    order = sorted(range(len(store)), key=store.value.__getitem__)
+    values = [store.value[i] for i in order]
+    if bounds is None:
+        bounds = address_bounds(values, count)
+    cuts = [0, *(bisect.bisect_left(values, bound) for bound in bounds), len(order)]
+
+    shards = {}
+    for i, (begin, end) in enumerate(pairwise(cuts)):
+        if begin == end:
+            continue
+        shard = copy.copy(elf)
+        shard.store = store.take(order[begin:end])
+        shard.emitted = None
+        # Up to where the next shard starts.
+        low = bounds[i - 1] if i else values[begin]
+        high = bounds[i] if i < len(bounds) else U64_MASK + 1
+        shard.ranges = {
+            name: (max(start, low), min(stop, high))
+            for name, (start, stop) in elf.ranges.items()
+            if start < high and low < stop
+        }
+        shard.textbase = _text_start(shard.store.value, shard.ranges.values())
+        shards[f"{i:03d}"] = shard
+    return shards
+
+
+def _text_start(values: Sequence[int], ranges: Iterable[tuple[int, int]]) -> int:
+    """
+    Return the first of the (sorted) `values` outside of all `ranges`.
+
+    If there is none, returns the end of the range holding the last value.
+    """
+    start = values[0]
+    for low, high in sorted(ranges):
+        if low <= start < high:
+            i = bisect.bisect_left(values, high)
+            start = values[i] if i < len(values) else high
+    return start
+
+
+def split_by_module(source: loaders.Source, textbase: int) -> dict[str, ELFFile]:
+    """
+    Split a `/proc/kallsyms` style listing into one shard per module.
+
+    The kernel itself (with `textbase`) is the "vmlinux" shard. A module's .text covers its
+    first address range (see `loaders.module_ranges`), any later ones (e.g. its data) get range
+    sections named like "[ext4].1", so the shards' sections don't overlap.
+    """
+    # Runtime import, ELFFile itself uses this module.
+    from .elf import ELFFile  # noqa: PLC0415
+
+    stores = loaders.load_kallsyms_modules(source)
+    module_ranges = loaders.module_ranges(stores)
+    shards = {}
+    for module, store in stores.items():
+        if not store:
+            continue
+        if not module:
+            shard = ELFFile(textbase)
+        else:
+            ranges = module_ranges.get(module, [])
+            shard = ELFFile(ranges[0][0] if ranges else min(store.value))
+            for i, (start, end) in enumerate(ranges[1:], 1):
+                shard.add_section(f"[{module}].{i}", start, end)
+        shard.store = store
+        shards[module or "vmlinux"] = shard
+    return shards
+
+
+def write_shards(
+    shards: Mapping[str, ELFFile],
+    directory: str | os.PathLike[str],
+    bounds: Sequence[int] = (),
+) -> ShardManifest:
+    """
+    Write every shard to `directory`, skipping the ones that didn't change since the last call.
+
+    Returns the new manifest, which lists the changed and removed shards. `bounds` are those of
+    shards from `split_by_address`, they are saved for the next split.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    previous = ShardManifest.load(directory)
+    manifest = ShardManifest(directory, {}, bounds=list(bounds))
+
+    for name, elf in shards.items():
+        store = elf.store
+        digest = fingerprint(elf)
+        shard = Shard(
+            file=f"{name}.elf",
+            start=elf.textbase,
+            # Like .text, one past the end of the last symbol even if it has no size.
+            end=max(
+                (value + size for value, size in zip(store.value, store.size, strict=True)),
+                default=elf.textbase,
+            )
+            + 1,
+            symbols=len(store),
+            digest=digest,
+        )
+        manifest.shards[name] = shard
+        old = previous.shards.get(name)
+        if old is None or old.digest != digest or not (directory / shard.file).exists():
+            write_atomic(directory / shard.file, elf.build())
+            manifest.changed.append(name)
+
+    for name, old in previous.shards.items():
+        if name not in manifest.shards:
+            (directory / old.file).unlink(missing_ok=True)
+            manifest.removed.append(name)
+
+    manifest.save()
+    return manifest
@@ -0,0 +1,50 @@
+"""Optional timings and counters of building and writing symbol files."""
+
+from __future__ import annotations
+
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+
+@dataclass
+class BuildStats:
+    """
+    Where the time of a build went, filled in by `ELFFile` and `ELFBuilder` when passed one.
+
+    Phases are "ingest" (loading and adding symbols), "strtab" (building .strtab, only
+    non-trivial with merge_strings), "symtab" (packing .symtab), "layout", "assemble" (copying
+    everything into the output buffer) and "io". Times accumulate over repeated phases, and
+    `callback` (if set) is called with the name and duration as each phase ends.
+    """
+
+    callback: Callable[[str, float], None] | None = None
+    # Wall time per phase, in seconds.
+    phases: dict[str, float] = field(default_factory=dict)
+    symbols: int = 0
+    # Symbols with the same name as an earlier one.
+    duplicates: int = 0
+    # Size of every section in the file, including reserved room.
+    section_bytes: dict[str, int] = field(default_factory=dict)
+    # open/write/close calls made for the output.
+    syscalls: int = 0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if self.callback is not None:
+                self.callback(name, elapsed)
+
+
+def phase(stats: BuildStats | None, name: str) -> AbstractContextManager[None]:
+    """Time a phase if stats are being collected, otherwise do nothing."""
+    return nullcontext() if stats is None else stats.phase(name)
@@ -0,0 +1,175 @@
+"""Writes symbol files from unbounded symbol iterators in constant memory."""
+
+from __future__ import annotations
+
+import ctypes
+import operator
+import shutil
+import tempfile
+from itertools import chain, islice
+from pathlib import Path
+from typing import IO, TYPE_CHECKING
+
+from . import datatypes
+from .builder import TEXT_INDEX, ELFBuilder
+from .structures import SymbolStore, rebased
+from .util import zig_target_arch_to_elf
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from types import TracebackType
+
+    from .structures import Symbol
+
+# Symbols serialized at once. Keeps the per-batch overhead negligible while the batch itself
+# stays at a few megabytes.
+BATCH_SIZE: int = 1 << 16
+
+
+class StreamingWriter:
+    """
+    Writes an ELF file with the same layout as `ELFFile.write`, without holding the symbols.
+
+    .symtab comes right after the ELF header, so its entries are written to the output file
+    batch by batch as they come in. The names are spooled to a temporary file, which is
+    appended once the number of symbols (and so the .strtab offset) is known, and the headers
+    are filled in last. Memory use is bounded by the batch size.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        textbase: int,
+        *,
+        relocatable: bool = False,
+        batch_size: int = BATCH_SIZE,
+    ) -> None:
+        """
+        Start writing a file to `path`.
+
+        `textbase` and `relocatable` have the same meaning as for `ELFFile`.
+        """
+        # Pinned like in ELFFile.__init__.
+        self.builder = ELFBuilder(zig_target_arch_to_elf("x86_64"), 64)
+        self.base = textbase if relocatable else 0
+        self.builder.add_text_section(textbase - self.base)
+        # Sets up the .symtab and .strtab headers, their sizes are fixed up in `close`. The
+        # contents are streamed instead, so `reserved` will stand in for them.
+        self.builder.add_symbols(SymbolStore())
+        self.symtab_index = self.builder.symtab_index
+        self.strtab_index = self.symtab_index + 1
+        for index in (self.symtab_index, self.strtab_index):
+            self.builder.sections[index].data = b""
+
+        self.batch_size = batch_size
+        self.entsize = ctypes.sizeof(self.builder.ElfSym)
+        self.count = 0
+        # Leading local symbols, or None once a local came after another symbol (see
+        # `SymbolStore.local_count`).
+        self.local_count: int | None = 0
+        # Where .text ends, at least 1 byte like with `ELFFile.write`.
+        self.max_addr = textbase - self.base
+        # Names written to the spool so far, plus the leading NUL.
+        self.strtab_size = 1
+
+        self.file: IO[bytes] = Path(path).open("wb")  # noqa: SIM115
+        self.spool: IO[bytes] = tempfile.TemporaryFile()  # noqa: SIM115
+        # .text is NOBITS, so .symtab starts right after the ELF header, NULL entry first.
+        self.file.seek(ctypes.sizeof(self.builder.ElfEhdr))
+        self.file.write(bytes(self.entsize))
+
+    def add_symbols(self, symbols: Iterable[Symbol]) -> None:
+        """Write out all symbols of `symbols`, which is consumed lazily."""
+        iterator = iter(symbols)
+        while batch := list(islice(iterator, self.batch_size)):
+            self.add_store(SymbolStore.from_symbols(batch))
+
+    def add_store(self, store: SymbolStore) -> None:
+        """Write out all symbols of a `SymbolStore`."""
+        if not store:
+            return
+
+        values = store.value
+        if self.base:
+            values = rebased(values, -self.base, self.builder.addr_mask)
+        self.max_addr = max(chain([self.max_addr], map(operator.add, values, store.size)))
+
+        # The store's table starts with its own NUL, which we already have.
+        shift = self.strtab_size - 1
+        st_name = map(shift.__add__, store.name)
+        entries = self.builder.pack_symtab(store, st_name, values)
+        self.file.write(memoryview(entries)[self.entsize :])
+        if self.local_count == self.count:
+            local_count = store.local_count()
+            self.local_count = None if local_count is None else self.local_count + local_count
+        elif self.local_count is not None and store.bind.count(datatypes.Constants.STB_LOCAL):
+            self.local_count = None
+        self.count += len(store)
+
+        names = memoryview(store.strtab.data)[1:]
+        self.spool.write(names)
+        self.strtab_size += len(names)
+
+    def close(self) -> None:
+        """Append .strtab and write all the headers."""
+        if self.file.closed:
+            return
+
+        sections = self.builder.sections
+        text = sections[TEXT_INDEX].header
+        text.sh_size = self.max_addr + 1 - text.sh_addr
+        symtab, strtab = sections[self.symtab_index], sections[self.strtab_index]
+        symtab.reserved = symtab.header.sh_size = (self.count + 1) * self.entsize
+        if self.local_count is not None:
+            symtab.header.sh_info = self.local_count + 1
+        strtab.reserved = strtab.header.sh_size = self.strtab_size
+
+        all_sections, shoff = self.builder.layout()
+        symtab_offset = symtab.header.sh_offset
+        if symtab_offset != ctypes.sizeof(self.builder.ElfEhdr):
+            raise AssertionError(f".symtab was streamed to the wrong offset ({symtab_offset}).")
+
+        f = self.file
+        f.seek(strtab.header.sh_offset)
+        f.write(b"\x00")
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, f)
+        self.spool.close()
+
+        shstrtab = all_sections[-1]
+        f.seek(shstrtab.header.sh_offset)
+        f.write(shstrtab.data)
+        f.seek(shoff)
+        f.write(b"".join(sec.packed_header() for sec in all_sections))
+        f.seek(0)
+        f.write(self.builder.elf_header(shoff, len(all_sections)))
+        f.close()
+
+    def __enter__(self) -> StreamingWriter:  # noqa: PYI034
+        """Return the writer itself, the file is finished on exit."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Finish the file, or just close it if there was an error."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.spool.close()
+            self.file.close()
+
+
+def write_stream(
+    path: str,
+    symbols: Iterable[Symbol],
+    textbase: int,
+    *,
+    relocatable: bool = False,
+) -> None:
+    """Write the symbols of an iterator to `path`, see `StreamingWriter`."""
+    with StreamingWriter(path, textbase, relocatable=relocatable) as writer:
+        writer.add_symbols(symbols)
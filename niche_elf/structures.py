@@ -2,16 +2,22 @@
 
 from __future__ import annotations
 
+import operator
+import sys
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING
+from itertools import accumulate, compress, islice, repeat
+from typing import TYPE_CHECKING, TypeAlias, cast, overload
 
 from . import datatypes
 
 if TYPE_CHECKING:
     import ctypes
+    from collections.abc import Iterable
 
 
-@dataclass
+@dataclass(slots=True)
 class Symbol:
     """Represents a symbol (function or global variable) in the binary."""
 
@@ -58,15 +64,13 @@ class Section:
     # `name` is not in the section header, but rather added to the shstrtab.
     name: str
     # `data` is the data of the section (also not in the section header)
-    data: bytes
+    data: bytes | bytearray
     # https://www.man7.org/linux/man-pages/man5/elf.5.html#:~:text=Section%20header%20%28Shdr
     header: ctypes.Structure
     # self.header.sh_offset should initially be set to -1 and then later populated
     # during write.
-
-    def padded_data(self) -> bytes:
-        pad_len = (-len(self.data)) % self.header.sh_addralign
-        return bytes(self.data + b"\x00" * pad_len)
+    # Zeroed bytes kept after `data` in the file, so the section can later grow in place.
+    reserved: int = 0
 
     def packed_header(self) -> bytes:
         if len(self.data) > self.header.sh_size:
@@ -81,19 +85,384 @@ class Section:
 
 
 @dataclass
-class SHStrTabEntry:
-    name: str
-    offset: int = 0
+class StrTab:
+    """
+    An ELF string table, used for both `.strtab` and `.shstrtab`.
 
+    Names are appended to a single bytearray, and bulk additions compute the offsets from the
+    name lengths and join all the names in one pass, so building the table is linear.
+    """
 
-@dataclass
-class SHStrTab:
-    entries: list[SHStrTabEntry] = field(default_factory=list)
-    data: bytes = b"\x00"
+    # The table always starts with an empty (NUL) string.
+    data: bytearray = field(default_factory=lambda: bytearray(1))
 
-    def add(self, name: str) -> int:
+    def add(self, name: str | bytes) -> int:
         """Add a name and return its offset."""
         offset = len(self.data)
-        self.entries.append(SHStrTabEntry(name, offset))
-        self.data += name.encode() + b"\x00"
+        self.data += name.encode() if isinstance(name, str) else name
+        self.data.append(0)
         return offset
+
+    def extend(self, names: Iterable[str] | Iterable[bytes]) -> array[int]:
+        """Add many names and return their offsets."""
+        names = cast("list[str] | list[bytes]", list(names))
+        if not names:
+            return array("I")
+
+        lengths: Iterable[int]
+        if isinstance(names[0], str):
+            joined = "\x00".join(names)
+            blob = joined.encode()
+            # Only pure ASCII names have the same length in characters and bytes.
+            if len(blob) == len(joined):
+                lengths = map(len, names)
+            else:
+                lengths = [len(name.encode()) for name in names]
+        else:
+            blob = b"\x00".join(names)
+            lengths = map(len, names)
+
+        offsets = array("I", accumulate(map((1).__add__, lengths), initial=len(self.data)))
+        offsets.pop()
+        self.data += blob
+        self.data.append(0)
+        return offsets
+
+    def get(self, offset: int) -> bytes:
+        """Return the (encoded) name at `offset`."""
+        return bytes(self.data[offset : self.data.index(0, offset)])
+
+    @classmethod
+    def merged(cls, names: list[bytes]) -> tuple[StrTab, array[int]]:
+        """
+        Build a deduplicated, tail-merged string table, like ld does for SHF_MERGE|SHF_STRINGS.
+
+        Identical names are stored once, and a name that is a suffix of another one (e.g. `foo`
+        in `do_foo`) points into the longer one. Returns the table and the offset of every name.
+        """
+        # A string is a suffix of another one iff its reverse is a prefix of the other's reverse,
+        # and after sorting the reverses such a prefix sorts right before its extensions. So
+        # walking them backwards, every string either ends where the previous (longer) one ends,
+        # or has to be emitted.
+        reversed_names = _reverse_all(names)
+        emitted: list[bytes] = []
+        ends: dict[bytes, int] = {}
+        size = 1
+        end = 0
+        prev = b""
+        for rev in sorted(set(reversed_names), reverse=True):
+            if not prev.startswith(rev):
+                emitted.append(rev)
+                end = size + len(rev)
+                size = end + 1
+            ends[rev] = end
+            prev = rev
+
+        strtab = cls()
+        strtab.extend(_reverse_all(emitted))
+        # Every name ends where its group ends.
+        offsets = array(
+            "I",
+            map(operator.sub, map(ends.__getitem__, reversed_names), map(len, names)),
+        )
+        return strtab, offsets
+
+
+def _reverse_all(names: Iterable[bytes]) -> list[bytes]:
+    return cast("list[bytes]", list(map(operator.getitem, names, repeat(slice(None, None, -1)))))
+
+
+# Symbol values are stored as unsigned 64-bit integers, and address arithmetic wraps around.
+U64_MASK = (1 << 64) - 1
+
+
+def rebased(values: array[int], delta: int, mask: int = U64_MASK) -> array[int]:
+    """Return a copy of `values` with `delta` added to every value, modulo `mask + 1`."""
+    return array("Q", map(operator.and_, map((delta & mask).__add__, values), repeat(mask)))
+
+
+def _ascending(values: array[int]) -> bool:
+    return all(map(operator.le, values, islice(values, 1, None)))
+
+
+# Column arguments can be anything `array` accepts, buffer-protocol objects (e.g. NumPy
+# arrays) of a matching integer width, or a single int that applies to every symbol.
+Column: TypeAlias = "Iterable[int] | int"
+
+_INTEGER_FORMATS = frozenset("bBhHiIlLqQnN")
+
+# Maps each `st_bind` byte to 1 if it is STB_LOCAL, else 0.
+_LOCAL_TABLE = bytes(bind == datatypes.Constants.STB_LOCAL for bind in range(256))
+
+
+def _column(typecode: str, values: Column, count: int) -> array[int]:
+    if isinstance(values, int):
+        return array(typecode, [values]) * count
+
+    result = array(typecode)
+    try:
+        view = memoryview(values)  # type: ignore[arg-type]
+    except TypeError:
+        result.extend(values)
+    else:
+        fmt = view.format.lstrip("@=<")
+        native = view.format[0] != "<" or sys.byteorder == "little"
+        if fmt in _INTEGER_FORMATS and view.itemsize == result.itemsize and native:
+            # Reinterpret the raw bytes, this also maps negative int64 kernel addresses onto
+            # their unsigned representation.
+            result.frombytes(view.cast("B") if view.c_contiguous else view.tobytes())
+        else:
+            result.extend(view.tolist())
+
+    if len(result) != count:
+        raise ValueError(f"Expected {count} values in column, got {len(result)}.")
+    return result
+
+
+@dataclass
+class SymbolStore:
+    """
+    Column-wise symbol storage, with one array per symbol table field.
+
+    Names live in `strtab`, which is emitted as the `.strtab` section as is, and `name` holds
+    each symbol's offset into it. No Python object is kept per symbol.
+    """
+
+    strtab: StrTab = field(default_factory=StrTab)
+    name: array[int] = field(default_factory=lambda: array("I"))
+    value: array[int] = field(default_factory=lambda: array("Q"))
+    size: array[int] = field(default_factory=lambda: array("Q"))
+    bind: array[int] = field(default_factory=lambda: array("B"))
+    typ: array[int] = field(default_factory=lambda: array("B"))
+
+    def __len__(self) -> int:
+        """Return the number of symbols."""
+        return len(self.name)
+
+    @classmethod
+    def from_symbols(cls, symbols: Iterable[Symbol]) -> SymbolStore:
+        symbols = symbols if isinstance(symbols, (list, tuple)) else list(symbols)
+        store = cls()
+        store.extend(
+            [s.name for s in symbols],
+            [s.value for s in symbols],
+            [s.size for s in symbols],
+            [s.bind for s in symbols],
+            [s.typ for s in symbols],
+        )
+        return store
+
+    def append(self, name: str | bytes, value: int, size: int, bind: int, typ: int) -> None:
+        self.name.append(self.strtab.add(name))
+        self.value.append(value)
+        self.size.append(size)
+        self.bind.append(bind)
+        self.typ.append(typ)
+
+    def extend(
+        self,
+        names: Iterable[str] | Iterable[bytes],
+        values: Column,
+        sizes: Column,
+        binds: Column,
+        types: Column,
+    ) -> None:
+        """Add symbols from parallel columns."""
+        # Convert everything before touching the store, so a bad column doesn't leave it
+        # half-updated.
+        names = cast("list[str] | list[bytes]", list(names))
+        count = len(names)
+        columns = (
+            _column("Q", values, count),
+            _column("Q", sizes, count),
+            _column("B", binds, count),
+            _column("B", types, count),
+        )
+
+        self.name.extend(self.strtab.extend(names))
+        for dest, column in zip((self.value, self.size, self.bind, self.typ), columns, strict=True):
+            dest.extend(column)
+
+    def raw_names(self) -> list[bytes]:
+        """Return the encoded name of every symbol, in order."""
+        count = len(self)
+        data = bytes(self.strtab.data)
+        parts = data.split(b"\x00")
+        starts = array("I", accumulate(map((1).__add__, map(len, parts)), initial=0))
+        # Names added through `append`/`extend` are laid out back to back, so they are exactly the
+        # NUL separated parts of the table.
+        if starts[1 : count + 1] == self.name:
+            return parts[1 : count + 1]
+        return [self.strtab.get(offset) for offset in self.name]
+
+    def compact(self) -> None:
+        """Rebuild `strtab` with only the names still referenced, in symbol order."""
+        names = self.raw_names()
+        self.strtab = StrTab()
+        self.name = self.strtab.extend(names)
+
+    def name_index(self) -> dict[bytes, list[int]]:
+        """Map every name to the slots (indices) of the symbols with that name."""
+        index: dict[bytes, list[int]] = {}
+        for slot, name in enumerate(self.raw_names()):
+            index.setdefault(name, []).append(slot)
+        return index
+
+    def remove_slots(
+        self,
+        slots: Iterable[int],
+        index: dict[bytes, list[int]],
+        local_count: int = 0,
+    ) -> list[int]:
+        """
+        Remove the symbols in `slots`, filling each hole with the current last symbol.
+
+        The removed symbols must already be gone from `index`, which is updated for the moved
+        ones. With `local_count`, the first that many symbols are kept before all others (see
+        `local_count`): a hole among them is filled with the last of them instead, which in
+        turn is filled with the last symbol. Returns the slots that now hold a moved symbol.
+        """
+        moved = []
+        # Highest slot first, so a slot we still have to remove never gets moved.
+        for slot in sorted(slots, reverse=True):
+            if slot < local_count:
+                local_count -= 1
+                if slot != local_count:
+                    self._move(local_count, slot, index)
+                    moved.append(slot)
+                slot = local_count  # noqa: PLW2901
+            last = len(self) - 1
+            if slot != last:
+                self._move(last, slot, index)
+                moved.append(slot)
+            for column in self._columns():
+                column.pop()
+        # A slot filled early may have been moved again (or popped) by a later removal.
+        return [slot for slot in dict.fromkeys(moved) if slot < len(self)]
+
+    def _columns(self) -> tuple[array[int], ...]:
+        return (self.name, self.value, self.size, self.bind, self.typ)
+
+    def _move(self, src: int, dst: int, index: dict[bytes, list[int]]) -> None:
+        """Overwrite the symbol in `dst` with the one in `src`, see `remove_slots`."""
+        for column in self._columns():
+            column[dst] = column[src]
+        same_name = index[self.strtab.get(self.name[dst])]
+        same_name[same_name.index(src)] = dst
+
+    def swap(self, a: int, b: int, index: dict[bytes, list[int]]) -> None:
+        """Exchange the symbols in slots `a` and `b`, updating `index` for both."""
+        for column in self._columns():
+            column[a], column[b] = column[b], column[a]
+        for slot, other in ((a, b), (b, a)):
+            same_name = index[self.strtab.get(self.name[slot])]
+            same_name[same_name.index(other)] = slot
+
+    def local_count(self) -> int | None:
+        """
+        Return the number of local symbols, if they all come before the other ones.
+
+        ELF requires that order, with `sh_info` of .symtab pointing past the locals. Returns
+        None if the symbols aren't in that order, see `laid_out`.
+        """
+        local = self.bind.tobytes().translate(_LOCAL_TABLE)
+        first_global = local.find(0)
+        if first_global == -1:
+            return len(local)
+        return first_global if local.find(1, first_global) == -1 else None
+
+    def laid_out(self) -> SymbolStore:
+        """
+        Return the symbols sorted by address, with the local symbols before all others.
+
+        The sort is stable, and the new store shares this store's string table. Returns this
+        store itself if it already is in that order.
+        """
+        local_count = self.local_count()
+        if (
+            local_count is not None
+            and _ascending(self.value[:local_count])
+            and _ascending(self.value[local_count:])
+        ):
+            return self
+
+        local = self.bind.tobytes().translate(_LOCAL_TABLE)
+        slots = range(len(self))
+        order = sorted(compress(slots, local), key=self.value.__getitem__)
+        order += sorted(compress(slots, map(operator.not_, local)), key=self.value.__getitem__)
+        # Two or more symbols, or they would already be in order. (With fewer the itemgetter
+        # wouldn't return a tuple.)
+        take = operator.itemgetter(*order)
+        return SymbolStore(
+            self.strtab,
+            *(array(column.typecode, take(column)) for column in self._columns()),
+        )
+
+    def take(self, indices: Sequence[int]) -> SymbolStore:
+        """Return a new store with the symbols at `indices`, in that order."""
+        names = self.raw_names()
+        store = SymbolStore()
+        store.extend(
+            list(map(names.__getitem__, indices)),
+            array("Q", map(self.value.__getitem__, indices)),
+            array("Q", map(self.size.__getitem__, indices)),
+            array("B", map(self.bind.__getitem__, indices)),
+            array("B", map(self.typ.__getitem__, indices)),
+        )
+        return store
+
+    def rebase(self, delta: int) -> None:
+        """Add `delta` to the value of every symbol."""
+        self.value = rebased(self.value, delta)
+
+    def copy(self) -> SymbolStore:
+        return SymbolStore(
+            strtab=StrTab(self.strtab.data[:]),
+            name=self.name[:],
+            value=self.value[:],
+            size=self.size[:],
+            bind=self.bind[:],
+            typ=self.typ[:],
+        )
+
+    def extend_from(self, other: SymbolStore) -> None:
+        """Append all symbols of another store."""
+        # The other table's leading NUL is dropped, so its offset 1 lands at our current end.
+        shift = len(self.strtab.data) - 1
+        self.strtab.data += memoryview(other.strtab.data)[1:]
+        self.name.extend(map(shift.__add__, other.name) if shift else other.name)
+        self.value.extend(other.value)
+        self.size.extend(other.size)
+        self.bind.extend(other.bind)
+        self.typ.extend(other.typ)
+
+
+class SymbolView(Sequence[Symbol]):
+    """Read-only sequence over a `SymbolStore`, for code that wants `Symbol` objects."""
+
+    def __init__(self, store: SymbolStore) -> None:
+        self.store = store
+
+    def __len__(self) -> int:
+        """Return the number of symbols."""
+        return len(self.store)
+
+    @overload
+    def __getitem__(self, index: int) -> Symbol: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Symbol]: ...
+
+    def __getitem__(self, index: int | slice) -> Symbol | list[Symbol]:
+        """Return the symbol(s) at `index`."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        store = self.store
+        return Symbol(
+            name=store.strtab.get(store.name[index]).decode(),
+            bind=store.bind[index],
+            typ=store.typ[index],
+            value=store.value[index],
+            size=store.size[index],
+        )
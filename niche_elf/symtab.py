@@ -0,0 +1,107 @@
+"""Packs whole symbol tables at once, without creating a ctypes object per entry."""
+
+from __future__ import annotations
+
+import ctypes
+import operator
+import sys
+from array import array
+from itertools import repeat
+from typing import TYPE_CHECKING, Literal, TypeAlias
+
+from . import datatypes
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping
+
+# "ctypes" builds an ElfSym instance per symbol and is kept around as the reference
+# implementation, "array" is the fast path implemented in this module.
+Backend: TypeAlias = Literal["array", "ctypes"]
+
+Column: TypeAlias = "array[int] | bytes | Iterable[int]"
+
+_TYPECODES: dict[int, Literal["B", "H", "I", "Q"]] = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def pack(entry: type[ctypes.Structure], count: int, columns: Mapping[str, Column]) -> bytearray:
+    """
+    Pack `count` entries of the `entry` structure, preceded by an all-zero entry.
+
+    Every column is scattered into its field with a single strided memoryview assignment,
+    using the field offsets and sizes from the ctypes definition so the result is byte-identical
+    to `b"".join(bytes(entry(...)) for ...)`. Fields without a column are left zeroed. A `bytes`
+    column is only valid for single-byte fields.
+    """
+    entsize = ctypes.sizeof(entry)
+    data = bytearray(entsize * (count + 1))
+    view = memoryview(data)
+
+    for name, column in columns.items():
+        field = getattr(entry, name)
+        typecode = _TYPECODES[field.size]
+        values = column
+        if not isinstance(values, array) or values.typecode != typecode:
+            values = array(typecode, values)
+        if len(values) != count:
+            raise ValueError(f"Column {name} has {len(values)} entries, expected {count}.")
+        # ELF files we emit are always little endian (see `ELFBuilder.e_ident`).
+        if sys.byteorder == "big" and field.size > 1:
+            values = array(typecode, values)
+            values.byteswap()
+
+        # Start one entry in, to skip the NULL entry.
+        start = (entsize + field.offset) // field.size
+        view.cast(typecode)[start :: entsize // field.size] = values
+
+    return data
+
+
+def pack_symbols(
+    entry: type[ctypes.Structure],
+    *,
+    st_name: Column,
+    st_value: Column,
+    st_shndx: Column,
+    st_size: Column,
+    bind: Iterable[int],
+    typ: Iterable[int],
+) -> bytearray:
+    """Pack a symbol table. `bind` and `typ` are combined into `st_info`."""
+    st_size = st_size if isinstance(st_size, array) else array("Q", st_size)
+    st_info = map(operator.or_, map(operator.lshift, bind, repeat(4)), typ)
+    return pack(
+        entry,
+        len(st_size),
+        {
+            "st_name": st_name,
+            "st_value": st_value,
+            "st_size": st_size,
+            "st_info": st_info,
+            "st_shndx": st_shndx,
+        },
+    )
+
+
+def pack_chunk(
+    ptrbits: int,
+    *,
+    st_name: array[int],
+    st_value: array[int],
+    st_shndx: array[int],
+    st_size: array[int],
+    bind: array[int],
+    typ: array[int],
+) -> bytearray:
+    """Like `pack_symbols`, but without the NULL entry. Runs in worker processes."""
+    entry = {32: datatypes.ElfSym32, 64: datatypes.ElfSym64}[ptrbits]
+    data = pack_symbols(
+        entry,
+        st_name=st_name,
+        st_value=st_value,
+        st_shndx=st_shndx,
+        st_size=st_size,
+        bind=bind,
+        typ=typ,
+    )
+    del data[: ctypes.sizeof(entry)]
+    return data
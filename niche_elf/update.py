@@ -0,0 +1,278 @@
+"""Folds symbol changes into an existing symbol file, without repacking the unchanged symbols."""
+
+from __future__ import annotations
+
+import ctypes
+from array import array
+from dataclasses import dataclass, field
+from itertools import compress
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal, TypeVar, cast
+
+from . import datatypes, loaders
+from .builder import TEXT_INDEX, ELFBuilder
+from .structures import SymbolStore
+from .util import write_atomic
+
+if TYPE_CHECKING:
+    import os
+    from collections.abc import Iterable, Sequence
+
+    from .elf import ELFFile
+
+Key = TypeVar("Key", bytes, int)
+
+
+@dataclass
+class SymbolChanges:
+    """
+    Symbol changes for `ELFFile.update_from`.
+
+    Removals are applied first. Then every upserted symbol replaces all symbols with the same
+    name (or at the same address with `key="address"`, e.g. for renames from a decompiler), or
+    is added if there are none. Many upserts can go into `upserts` at once with
+    `SymbolStore.extend`.
+    """
+
+    key: Literal["name", "address"] = "name"
+    upserts: SymbolStore = field(default_factory=SymbolStore)
+    removed_names: set[bytes] = field(default_factory=set)
+    removed_addresses: set[int] = field(default_factory=set)
+
+    def upsert(
+        self,
+        name: str | bytes,
+        addr: int,
+        size: int = 0,
+        bind: int = datatypes.Constants.STB_GLOBAL,
+        typ: int = datatypes.Constants.STT_COMMON,
+    ) -> None:
+        """Add or replace a symbol. Defaults match `ELFFile.add_generic_symbol`."""
+        self.upserts.append(name, addr, size, bind, typ)
+
+    def remove(self, name: str | bytes) -> None:
+        """Remove all symbols called `name`."""
+        self.removed_names.add(name.encode() if isinstance(name, str) else name)
+
+    def remove_address(self, addr: int) -> None:
+        """Remove all symbols at `addr`."""
+        self.removed_addresses.add(addr)
+
+
+def apply_changes(store: SymbolStore, changes: SymbolChanges) -> tuple[set[int], set[int]]:
+    """
+    Apply `changes` to `store` without moving any symbol.
+
+    Replaced symbols are updated in their slot and new ones appended, with their names appended
+    to `store.strtab`. Removed symbols are left in place. Returns the slots of the replaced and
+    of the removed symbols.
+    """
+    upserts = changes.upserts
+    upsert_names = upserts.raw_names()
+    # Only the names and addresses that are changed are indexed.
+    names = set(changes.removed_names)
+    addrs = set(changes.removed_addresses)
+    if changes.key == "name":
+        names.update(upsert_names)
+    else:
+        addrs.update(upserts.value)
+    by_name = _index(store.raw_names(), names) if names else {}
+    by_addr = _index(store.value, addrs) if addrs else {}
+
+    removed: set[int] = set()
+    for name in changes.removed_names:
+        removed.update(by_name.get(name, ()))
+    for addr in changes.removed_addresses:
+        removed.update(by_addr.get(addr, ()))
+
+    index = cast("dict[bytes | int, list[int]]", by_name if changes.key == "name" else by_addr)
+    changed: set[int] = set()
+    for i, name in enumerate(upsert_names):
+        value = upserts.value[i]
+        key: bytes | int = name if changes.key == "name" else value
+        slots = [slot for slot in index.get(key, ()) if slot not in removed]
+        if not slots:
+            store.append(name, value, upserts.size[i], upserts.bind[i], upserts.typ[i])
+            index.setdefault(key, []).append(len(store) - 1)
+            continue
+
+        slot, *duplicates = slots
+        removed.update(duplicates)
+        if store.strtab.get(store.name[slot]) != name:
+            store.name[slot] = store.strtab.add(name)
+        store.value[slot] = value
+        store.size[slot] = upserts.size[i]
+        store.bind[slot] = upserts.bind[i]
+        store.typ[slot] = upserts.typ[i]
+        changed.add(slot)
+
+    return changed - removed, removed
+
+
+def _index(keys: Sequence[Key], wanted: set[Key]) -> dict[Key, list[int]]:
+    """Map every key of `wanted` to its slots in `keys`."""
+    index: dict[Key, list[int]] = {}
+    # The scan over all keys stays in C, only the matches are handled in Python.
+    for slot in compress(range(len(keys)), map(wanted.__contains__, keys)):
+        index.setdefault(keys[slot], []).append(slot)
+    return index
+
+
+def _columns(store: SymbolStore) -> tuple[array[int], ...]:
+    return (store.name, store.value, store.size, store.bind, store.typ)
+
+
+def _drop(column: array[int], slots: Iterable[int]) -> array[int]:
+    """Return `column` without the entries at the (sorted) `slots`."""
+    result = array(column.typecode)
+    start = 0
+    for slot in slots:
+        result += column[start:slot]
+        start = slot + 1
+    result += column[start:]
+    return result
+
+
+def _ranges(sections: Sequence[tuple[bytes, ctypes.Structure]]) -> dict[str, tuple[int, int]]:
+    """Return the range sections of a file we wrote, see `ELFFile.add_section`."""
+    return {
+        name.decode(): (header.sh_addr, header.sh_addr + header.sh_size)
+        for name, header in sections[TEXT_INDEX + 1 :]
+        if header.sh_type == datatypes.Constants.SHT_NOBITS
+    }
+
+
+def _rebuild(elf: ELFFile, like: ELFBuilder, path: str | os.PathLike[str]) -> None:
+    """Write all of `elf` to `path`, like `ELFFile.write` but for the machine of `like`."""
+    elf.ptrsize = like.ptrbits
+    writer = elf.builder()
+    # ELFFile only knows zig target names.
+    writer.e_machine = like.e_machine
+    write_atomic(path, writer.build())
+    elf.emitted = elf.store.copy()
+
+
+def _output_path(
+    existing_path: str | os.PathLike[str],
+    path: str | os.PathLike[str] | None,
+    *,
+    own: bool,
+) -> str | os.PathLike[str]:
+    """Return where to write the updated file, `existing_path` only if we wrote it."""
+    if path is not None:
+        return path
+    if not own:
+        # Don't replace e.g. a vmlinux with a file of only its symbols.
+        raise ValueError(
+            f"{existing_path} was not written by niche-elf, pass the path to write the result to.",
+        )
+    return existing_path
+
+
+def update_file(
+    existing_path: str | os.PathLike[str],
+    changes: SymbolChanges,
+    path: str | os.PathLike[str] | None,
+) -> ELFFile:
+    """See `ELFFile.update_from`."""
+    # Runtime import, ELFFile itself uses this module.
+    from .elf import ELFFile  # noqa: PLC0415
+
+    image = Path(existing_path).read_bytes()
+    ehdr, sections = loaders.elf_headers(image)
+    elf = ELFFile(0)
+    store = elf.store
+    elf.textbase = loaders.load_elf(store, image) or 0
+    symtab = next(
+        (header for _, header in sections if header.sh_type == datatypes.Constants.SHT_SYMTAB),
+        None,
+    )
+
+    old_count = len(store)
+    old_local_count = store.local_count()
+    changed, removed = apply_changes(store, changes)
+
+    # The replaced entries and the new ones, in file order. (New symbols can be replaced by a
+    # later upsert too, but they are packed anyway.) Taken before the removed ones are dropped.
+    replaced = sorted(slot for slot in changed if slot < old_count)
+    packed_slots = replaced + list(range(old_count, len(store)))
+    packed_store = SymbolStore(
+        store.strtab,
+        *(array(col.typecode, map(col.__getitem__, packed_slots)) for col in _columns(store)),
+    )
+    if removed:
+        for column in _columns(store):
+            column[:] = _drop(column, sorted(removed))
+    local_count = store.local_count()
+    if old_local_count is not None and local_count is None:
+        # New or changed locals ended up after other symbols, lay the whole table out again.
+        elf.sort_symbols = True
+
+    builder = ELFBuilder(ehdr.e_machine, image[4] * 32)
+    entsize = ctypes.sizeof(builder.ElfSym)
+    # Files we wrote have .text first and no skipped entries, so symbol i is entry i + 1 and the
+    # entries can be copied over. Anything else is rebuilt from scratch.
+    own = (
+        symtab is not None
+        and len(sections) > TEXT_INDEX
+        and sections[TEXT_INDEX][0] == b".text"
+        and symtab.sh_size == (old_count + 1) * entsize
+    )
+    path = _output_path(existing_path, path, own=own)
+    elf.ranges = _ranges(sections) if own else {}
+
+    if symtab is None or not own or elf.sort_symbols:
+        _rebuild(elf, builder, path)
+        return elf
+
+    text = sections[TEXT_INDEX][1]
+    builder.add_text_section(text.sh_addr)
+    for name, (start, end) in elf.ranges.items():
+        builder.add_range_section(name, start, end)
+
+    st_shndx = builder.section_indices(packed_store.value)
+    packed = memoryview(
+        builder.pack_symtab(packed_store, packed_store.name, packed_store.value, st_shndx),
+    )
+
+    # Everything between the replaced or removed entries is copied as is. The NULL entry comes
+    # first in both.
+    old = memoryview(image)[symtab.sh_offset : symtab.sh_offset + symtab.sh_size]
+    data = bytearray((len(store) + 1) * entsize)
+    pos = prev = packed_pos = entsize
+    for slot in sorted(removed.union(replaced)):
+        end = (slot + 1) * entsize
+        data[pos : pos + end - prev] = old[prev:end]
+        pos += end - prev
+        prev = end + entsize
+        if slot not in removed:
+            data[pos : pos + entsize] = packed[packed_pos : packed_pos + entsize]
+            pos += entsize
+            packed_pos += entsize
+    data[pos : pos + len(old) - prev] = old[prev:]
+    pos += len(old) - prev
+    data[pos:] = packed[packed_pos:]
+
+    # Grow .text to cover new symbols in it, see ELFBuilder.add_symbols.
+    text_end = max(
+        (
+            value + size
+            for value, size, shndx in zip(
+                packed_store.value,
+                packed_store.size,
+                st_shndx,
+                strict=True,
+            )
+            if shndx == TEXT_INDEX
+        ),
+        default=0,
+    )
+    builder.sections[TEXT_INDEX].header.sh_size = max(text.sh_size, text_end + 1 - text.sh_addr)
+    builder.add_symbol_sections(
+        data,
+        store.strtab.data,
+        first_global=1 if local_count is None else local_count + 1,
+    )
+    write_atomic(path, builder.build())
+    elf.emitted = store.copy()
+    return elf
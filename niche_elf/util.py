@@ -1,6 +1,26 @@
+import os
+import tempfile
+from pathlib import Path
+
 from .datatypes import Constants
 
 
+def write_atomic(path: str | os.PathLike[str], data: bytes | bytearray) -> None:
+    """
+    Write `data` to a temporary file next to `path` and rename it over `path`.
+
+    Readers see either the old or the new contents, never a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=Path(path).parent, prefix=".niche-elf-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        Path(tmp_path).replace(path)
+    except:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
 # https://github.com/ziglang/zig/blob/738d2be9d6b6ef3ff3559130c05159ef53336224/lib/std/Target.zig#L1038
 def zig_target_arch_to_elf(zigarch: str) -> int:  # noqa: C901, PLR0911, PLR0912
     """